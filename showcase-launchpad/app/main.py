@@ -3,10 +3,10 @@ from dotenv import load_dotenv
 from fastapi import FastAPI, Depends, Request
 from fastapi.middleware.cors import CORSMiddleware
 
-from helpers import get_current_user, get_admin_access, setup_logger, limiter, AuthInfo, get_client_ip
+from helpers import get_current_user, get_admin_access, setup_logger, limiter, AuthInfo, get_client_ip, FastJSONResponse, get_log_stats, MetricsMiddleware, metrics_response, ProfilingMiddleware, metrics_summary
 
 load_dotenv()
-app = FastAPI(root_path="/v1/app")
+app = FastAPI(root_path="/v1/app", default_response_class=FastJSONResponse)
 
 # Add CORS middleware
 app.add_middleware(
@@ -16,27 +16,42 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(ProfilingMiddleware, service="app")
+app.add_middleware(MetricsMiddleware)
 
 app.state.limiter = limiter
 logger = setup_logger("app", f"../logs/app/output.log")
+ERROR_RATE_DEGRADED = float(os.getenv("ERROR_RATE_DEGRADED", "0.01"))  # share of 5xx responses
 
 @app.get("/health")
 def health(): return {"status": "app is healthy"}
 
+@app.get("/metrics")
+def metrics(_=Depends(get_admin_access)):
+    return metrics_response()
+
+@app.get("/log-stats")
+def log_stats(_=Depends(get_admin_access)):
+    return get_log_stats()
+
 @app.get("/public-info")
 @limiter.limit("20/minute")
 def get_public_info(request: Request):
-    logger.info(f"Public info requested by {get_client_ip(request)}")
+    logger.info("Public info requested by %s", get_client_ip(request))
     return {"message": "This is a public endpoint, anyone can see this."}
 
 @app.get("/user/secret-data")
 @limiter.limit("20/minute")
 async def read_user_secret_data(request: Request, current_user: AuthInfo = Depends(get_current_user)):
-    logger.info(f"User-specific secret data requested for user_id {current_user.user_id}")
+    logger.info("User-specific secret data requested for user_id %s", current_user.user_id)
     return {"user_id": current_user.user_id, "email": current_user.email, "secret": "The secret ingredient is friendship."}
 
 @app.get("/admin/system-status")
 @limiter.limit("5/minute")
 async def read_admin_dashboard(request: Request, _=Depends(get_admin_access)):
-    logger.warning(f"Admin system status accessed by {get_client_ip(request)}")
-    return {"message": "Welcome, Admin! System status: All systems nominal."}
+    logger.warning("Admin system status accessed by %s", get_client_ip(request))
+    summary = metrics_summary()
+    degraded = summary["error_rate"] > ERROR_RATE_DEGRADED or summary["log_records_dropped"] > 0
+    # Judged on this app worker's own metrics only, not the other workers or services
+    status = "Degraded, see metrics." if degraded else "All systems nominal."
+    return {"message": f"Welcome, Admin! App process status: {status}", "status": "degraded" if degraded else "ok", "scope": "app process", "metrics": summary}
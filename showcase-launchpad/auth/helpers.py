@@ -1,21 +1,79 @@
 import os
+import copy
+import sys
+import json
+import atexit
+import asyncio
+import hashlib
 import logging
 import sqlite3
 import time
 import random
+import queue
+import re
+import contextvars
+import threading
+from bisect import bisect_left
+from collections import OrderedDict
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler, WatchedFileHandler
+from concurrent.futures import Future
+from contextlib import contextmanager
+from email.utils import format_datetime, parsedate_to_datetime
 from datetime import datetime, timedelta, timezone
-from typing import Optional, Dict
+from typing import Optional, Dict, Callable, Hashable, Iterable
 
 import jwt
-from fastapi import Depends, HTTPException, Request, Header, Security
+from fastapi import Depends, HTTPException, Request, Security
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials, APIKeyHeader
+from pydantic import BaseModel
 from slowapi import Limiter
-from slowapi.util import get_remote_address
+from limits.storage import Storage, SlidingWindowCounterSupport
+
+try:
+    import orjson
+except ImportError:  # falls back to the stdlib encoder, same output, just slower
+    orjson = None
 
 JWT_SECRET = os.getenv("JWT_SECRET", "default-secret-key")
 ALGORITHM = "HS256"
 ADMIN_API_KEY = os.getenv("ADMIN_API_KEY")
 DB_PATH = os.getenv("DB_PATH", "data.db")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "8"))
+DB_WRITER_POOL_SIZE = int(os.getenv("DB_WRITER_POOL_SIZE", "4"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "5"))
+DB_HEALTHCHECK_INTERVAL = float(os.getenv("DB_HEALTHCHECK_INTERVAL", "30"))
+DB_CACHE_SIZE_KB = int(os.getenv("DB_CACHE_SIZE_KB", "16384"))
+DB_MMAP_SIZE = int(os.getenv("DB_MMAP_SIZE", str(256 * 1024 * 1024)))
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", "500"))
+WRITE_QUEUE_ENABLED = os.getenv("WRITE_QUEUE_ENABLED", "true").lower() in ("1", "true", "yes")
+WRITE_BATCH_WINDOW = float(os.getenv("WRITE_BATCH_WINDOW_MS", "2")) / 1000
+WRITE_BATCH_MAX = int(os.getenv("WRITE_BATCH_MAX", "256"))
+CACHE_TTL = float(os.getenv("CACHE_TTL", "30"))
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "10000"))
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+RAW_JSON_COLUMNS = os.getenv("RAW_JSON_COLUMNS", "false").lower() in ("1", "true", "yes")
+JWT_CACHE_MAX_ENTRIES = int(os.getenv("JWT_CACHE_MAX_ENTRIES", "10000"))
+# sqlite:///relative.db or sqlite:////abs/path.db (e.g. /dev/shm to keep it in RAM), memory:// for per-process limits
+RATE_LIMIT_STORAGE_URI = os.getenv("RATE_LIMIT_STORAGE_URI", "sqlite:///ratelimit.db")
+RATE_LIMIT_STRATEGY = os.getenv("RATE_LIMIT_STRATEGY", "sliding-window-counter")
+RATE_LIMIT_TIMEOUT_MS = float(os.getenv("RATE_LIMIT_TIMEOUT_MS", "20"))  # longest wait for a locked ratelimit.db, then fail open
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_QUEUE_POLICY = os.getenv("LOG_QUEUE_POLICY", "drop")  # drop | block, WARNING and above always block
+LOG_BLOCK_TIMEOUT = float(os.getenv("LOG_BLOCK_TIMEOUT", "1"))
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")  # json | text, for the log file; the console stays text
+# size: rotate at LOG_MAX_BYTES, only safe while a single process writes the file.
+# external: reopen the file after logrotate moves it; use this with several workers.
+LOG_ROTATION = os.getenv("LOG_ROTATION", "size")
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(20 * 1024 * 1024)))
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "5"))
+METRICS_SQLITE_TIMINGS = os.getenv("METRICS_SQLITE_TIMINGS", "true").lower() in ("1", "true", "yes")  # ~2 us per statement
+PROFILE_ENABLED = os.getenv("PROFILE_ENABLED", "false").lower() in ("1", "true", "yes")
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0.01"))  # share of matching requests profiled
+PROFILE_PATHS = [p.strip() for p in os.getenv("PROFILE_PATHS", "").split(",") if p.strip()]  # path prefixes, empty = all
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL_MS", "2")) / 1000
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "100"))  # profiles kept per service, oldest are deleted
 
 admin_key_scheme = APIKeyHeader(
     name="X-Admin-API-Key",
@@ -25,7 +83,6 @@ admin_key_scheme = APIKeyHeader(
 )
 
 reusable_oauth2 = HTTPBearer()
-limiter = Limiter(key_func=get_remote_address, default_limits=["100/minute"])
 
 # --- JWT ---
 def create_jwt(data: dict, expires_delta: Optional[timedelta] = None) -> str:
@@ -46,57 +103,1301 @@ class AuthInfo:
         self.user_id = user_id
         self.email = email
 
-async def get_current_user(token: HTTPAuthorizationCredentials = Depends(reusable_oauth2)) -> AuthInfo:
-    payload = decode_jwt(token.credentials)
+def verify_token(token: str) -> AuthInfo:
+    # The secret is part of the key, so a rotated secret never matches an old entry
+    key = hashlib.sha256(f"{JWT_SECRET}.{token}".encode()).digest()
+    user = token_cache.get(key)
+    if user is not None:
+        return user
+    payload = decode_jwt(token)
     if payload is None:
         raise HTTPException(status_code=403, detail="Invalid or expired token")
     user_id = payload.get("sub")
     email = payload.get("email")
     if user_id is None or email is None:
         raise HTTPException(status_code=403, detail="Invalid token payload")
-    return AuthInfo(user_id=user_id, email=email)
+    user = AuthInfo(user_id=user_id, email=email)
+    exp = payload.get("exp")
+    if exp is not None:
+        token_cache.set(key, user, ttl=exp - time.time())
+    return user
+
+async def get_current_user(token: HTTPAuthorizationCredentials = Depends(reusable_oauth2)) -> AuthInfo:
+    return verify_token(token.credentials)
 
 async def get_admin_access(x_admin_api_key: str = Security(admin_key_scheme)):
     if not x_admin_api_key or x_admin_api_key != ADMIN_API_KEY:
         raise HTTPException(status_code=403, detail="Forbidden: Invalid Admin API Key")
     return True
 
+# --- JSON Serialization ---
+class RawJSON:
+    # Already encoded JSON (a stored TEXT column) that is written into a
+    # response as-is instead of being parsed and encoded again.
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+def _json_default(obj):
+    if isinstance(obj, RawJSON):
+        if orjson is not None and hasattr(orjson, "Fragment"):
+            return orjson.Fragment(obj.value)
+        return json_loads(obj.value)
+    if isinstance(obj, BaseModel):
+        return obj.model_dump(mode="json")
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+def json_loads(data):
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+def json_dumps(obj) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj, default=_json_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, default=_json_default, separators=(",", ":"), ensure_ascii=False).encode()
+
+def json_column(value, empty, raw: bool = False):
+    # Decoder for JSON TEXT columns; raw=True is only safe for responses that
+    # skip response_model validation (i.e. are returned as FastJSONResponse).
+    if not value:
+        return empty
+    return RawJSON(value) if raw else json_loads(value)
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content) -> bytes:
+        return json_dumps(content)
+
 # --- Logging ---
+# Request handlers only put records on a bounded queue; a QueueListener thread
+# formats and writes them, so disk or journald stalls stay off request latency.
+# Log with %-style args (logger.info("x %s", y)): formatting happens on the listener.
+TEXT_LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+class JSONLogFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc"] = record.exc_text
+        return json_dumps(entry).decode()
+
+class BoundedQueueHandler(QueueHandler):
+    def __init__(self, capacity: int = LOG_QUEUE_SIZE, policy: str = LOG_QUEUE_POLICY):
+        super().__init__(queue.Queue(capacity))
+        self.capacity = capacity
+        self.policy = policy
+        self.enqueued = 0
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Unlike the stdlib handler, msg/args are left for the listener to format;
+        # only a traceback is rendered here, while its frames are still current.
+        if record.exc_info:
+            record = copy.copy(record)
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        # Runs under the handler lock, so the counters need no lock of their own
+        try:
+            if self.policy == "block" or record.levelno >= logging.WARNING:
+                self.queue.put(record, timeout=LOG_BLOCK_TIMEOUT)
+            else:
+                self.queue.put_nowait(record)
+            self.enqueued += 1
+        except queue.Full:
+            self.dropped += 1
+
+    def stats(self) -> dict:
+        return {
+            "policy": self.policy,
+            "capacity": self.capacity,
+            "queued": self.queue.qsize(),
+            "enqueued": self.enqueued,
+            "dropped": self.dropped,
+        }
+
+_log_handlers: Dict[str, BoundedQueueHandler] = {}
+_log_listeners = []
+
 def setup_logger(name: str, log_path: str):
     logger = logging.getLogger(name)
     if logger.hasHandlers():
         return logger
     logger.setLevel(logging.INFO)
-    log_path_obj = logging.FileHandler(log_path)
-    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-    log_path_obj.setFormatter(formatter)
-    logger.addHandler(log_path_obj)
+    # Every worker rotating the same file on its own loses records, so
+    # multi-worker deployments set LOG_ROTATION=external and rotate with logrotate
+    if LOG_ROTATION == "external":
+        file_handler = WatchedFileHandler(log_path)
+    else:
+        file_handler = RotatingFileHandler(log_path, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT)
+    file_handler.setFormatter(JSONLogFormatter() if LOG_FORMAT == "json" else logging.Formatter(TEXT_LOG_FORMAT))
     stream_handler = logging.StreamHandler()
-    stream_handler.setFormatter(formatter)
-    logger.addHandler(stream_handler)
+    stream_handler.setFormatter(logging.Formatter(TEXT_LOG_FORMAT))
+    queue_handler = BoundedQueueHandler()
+    listener = QueueListener(queue_handler.queue, file_handler, stream_handler, respect_handler_level=True)
+    listener.start()
+    logger.addHandler(queue_handler)
+    _log_handlers[name] = queue_handler
+    _log_listeners.append(listener)
     return logger
 
-# --- SQLite WAL Mode and Retry ---
-def get_db():
-    db = sqlite3.connect(DB_PATH, check_same_thread=False)
+def get_log_stats() -> dict:
+    return {name: handler.stats() for name, handler in list(_log_handlers.items())}
+
+@atexit.register
+def stop_log_listeners():
+    # Drains what is still queued before the process exits
+    for listener in _log_listeners:
+        listener.stop()
+    _log_listeners.clear()
+
+# --- Metrics ---
+# Process-local counters and histograms, rendered in the Prometheus text format
+# by render_metrics(). Every uvicorn worker reports its own figures; sum them in
+# the query. Label values are passed positionally in the order of `labels`.
+METRICS_LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+METRICS_SQLITE_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1.0)
+PROCESS_STARTED = time.time()
+
+_metrics = []
+
+def _escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _label_text(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape_label(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values: Dict[tuple, float] = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def inc(self, amount: float = 1, *labels):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def values(self) -> dict:
+        with self._lock:
+            return dict(self._values)
+
+    def total(self) -> float:
+        return sum(self.values().values())
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, _label_text(self.labels, key), value) for key, value in self._values.items()]
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = METRICS_LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        # labels -> per-bucket counts (last one is +Inf), then the sum
+        self._series: Dict[tuple, list] = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def observe(self, value: float, *labels):
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[i] += 1
+            series[-1] += value
+
+    def summary(self, quantiles=(0.5, 0.95, 0.99), match: Optional[Callable] = None) -> dict:
+        # Merged over all label sets (or those `match` accepts); quantiles are
+        # interpolated inside a bucket the way histogram_quantile() does.
+        with self._lock:
+            merged = [0] * (len(self.buckets) + 2)
+            for key, series in self._series.items():
+                if match is None or match(*key):
+                    merged = [a + b for a, b in zip(merged, series)]
+        count, total = sum(merged[:-1]), merged[-1]
+        result = {"count": count, "avg": total / count if count else 0.0}
+        for q in quantiles:
+            result[f"p{round(q * 100)}"] = self._quantile(q, merged[:-1], count)
+        return result
+
+    def _quantile(self, q: float, counts: list, count: int) -> float:
+        if not count:
+            return 0.0
+        rank, seen = q * count, 0
+        for i, n in enumerate(counts):
+            if seen + n >= rank and n:
+                if i == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[i - 1] if i else 0.0
+                return lower + (self.buckets[i] - lower) * (rank - seen) / n
+            seen += n
+        return self.buckets[-1]
+
+    def samples(self):
+        out = []
+        with self._lock:
+            series_items = [(key, list(series)) for key, series in self._series.items()]
+        for key, series in series_items:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), series[:-1]):
+                cumulative += n
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                out.append((f"{self.name}_bucket", _label_text(self.labels, key, f'le="{le}"'), cumulative))
+            out.append((f"{self.name}_sum", _label_text(self.labels, key), series[-1]))
+            out.append((f"{self.name}_count", _label_text(self.labels, key), cumulative))
+        return out
+
+class CallbackMetric:
+    # Read at scrape time from state that is tracked elsewhere (pool stats, queue depth)
+    def __init__(self, name: str, help: str, fn: Callable, kind: str = "gauge", labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.fn = fn
+        self.kind = kind
+        self.labels = labels
+        _metrics.append(self)
+
+    def samples(self):
+        values = self.fn()
+        if not isinstance(values, dict):
+            values = {(): values}
+        return [(self.name, _label_text(self.labels, key), value) for key, value in values.items()]
+
+def render_metrics() -> str:
+    lines = []
+    for metric in list(_metrics):
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for name, labels, value in metric.samples():
+            lines.append(f"{name}{labels} {value}")
+    return "\n".join(lines) + "\n"
+
+def metrics_response() -> Response:
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+def _resident_memory_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+HTTP_REQUESTS = Counter("http_requests_total", "HTTP requests by route and status.", ("method", "route", "status"))
+HTTP_LATENCY = Histogram("http_request_duration_seconds", "HTTP request latency until the last body byte.", ("method", "route"))
+RATE_LIMIT_REJECTIONS = Counter("rate_limit_rejections_total", "Requests refused with 429 by the rate limiter.", ("route",))
+RATE_LIMIT_FAIL_OPEN = Counter("rate_limit_fail_open_total", "Rate limit checks let through because the limiter database stayed locked.")
+SQLITE_QUERY_SECONDS = Histogram("sqlite_query_duration_seconds", "SQLite statement execution time.", ("statement",), METRICS_SQLITE_BUCKETS)
+SQLITE_WRITE_RETRIES = Counter("sqlite_write_retries_total", "safe_write retries after 'database is locked'.", ("mode",))
+SQLITE_WRITE_RETRIES_EXHAUSTED = Counter("sqlite_write_retries_exhausted_total", "safe_write calls that stayed locked after every retry.", ("mode",))
+CallbackMetric("process_uptime_seconds", "Seconds since this worker started.", lambda: round(time.time() - PROCESS_STARTED, 3))
+CallbackMetric("process_resident_memory_bytes", "Resident set size of this worker.", _resident_memory_bytes)
+CallbackMetric("log_records_dropped_total", "Log records dropped because the log queue was full.",
+               lambda: {(name,): h.dropped for name, h in list(_log_handlers.items())}, "counter", ("logger",))
+CallbackMetric("log_queue_depth", "Log records waiting for the listener thread.",
+               lambda: {(name,): h.queue.qsize() for name, h in list(_log_handlers.items())}, "gauge", ("logger",))
+
+class MetricsMiddleware:
+    # Plain ASGI so streaming bodies pass through untouched. The route label is
+    # the path template ("/download/{file_id}"), never the raw URL.
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        started = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            route = getattr(route, "path", "<unmatched>")
+            method = scope["method"]
+            HTTP_LATENCY.observe(time.perf_counter() - started, method, route)
+            HTTP_REQUESTS.inc(1, method, route, status)
+            if status == 429:
+                RATE_LIMIT_REJECTIONS.inc(1, route)
+
+def metrics_summary() -> dict:
+    # Only this process: other workers and services keep their own metrics,
+    # scrape each one's /metrics for the whole picture.
+    requests = HTTP_REQUESTS.values()
+    total = sum(requests.values())
+    errors = sum(value for (_, _, status), value in requests.items() if status >= 500)
+    latency = HTTP_LATENCY.summary()
+    queries = SQLITE_QUERY_SECONDS.summary()
+    return {
+        "scope": "process",
+        "pid": os.getpid(),
+        "uptime_seconds": round(time.time() - PROCESS_STARTED, 1),
+        "resident_memory_bytes": _resident_memory_bytes(),
+        "requests": int(total),
+        "server_errors": int(errors),
+        "error_rate": round(errors / total, 4) if total else 0.0,
+        "rate_limited": int(RATE_LIMIT_REJECTIONS.total()),
+        "latency_ms": {k: round(v * 1000, 2) for k, v in latency.items() if k != "count"},
+        "sqlite_queries": queries["count"],
+        "sqlite_query_ms": {k: round(v * 1000, 3) for k, v in queries.items() if k != "count"},
+        "sqlite_write_retries": int(SQLITE_WRITE_RETRIES.total()),
+        "log_records_dropped": sum(h.dropped for h in list(_log_handlers.values())),
+    }
+
+# --- Request Profiling ---
+# Opt-in sampling profiler. A request is profiled when PROFILE_ENABLED is set
+# and it wins the PROFILE_SAMPLE_RATE draw (limited to PROFILE_PATHS), or when
+# it carries "X-Profile-Request: 1" with a valid admin key. While it runs, a
+# sampler thread snapshots the stacks of the threads executing service code
+# every PROFILE_INTERVAL, and the SQLite statements run in the request's
+# context are timed. One profile runs at a time; stacks of other requests
+# that happen to run concurrently show up in it too. Each profile is written
+# to logs/<service>/profiles/ as .collapsed (flamegraph.pl, speedscope),
+# .speedscope.json and .meta.json with the request and its SQL timings.
+_active_profile: contextvars.ContextVar = contextvars.ContextVar("active_profile", default=None)
+_profile_lock = threading.Lock()
+SERVICE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+class RequestProfile:
+    def __init__(self, interval: float = PROFILE_INTERVAL):
+        self.interval = interval
+        self.stacks: Dict[tuple, int] = {}
+        self.statements = []
+        self.started = time.perf_counter()
+        self.duration = 0.0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, name="request-profiler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.duration = time.perf_counter() - self.started
+
+    def _sample(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                stack = self._stack(frame)
+                if stack is not None:
+                    self.stacks[stack] = self.stacks.get(stack, 0) + 1
+
+    @staticmethod
+    def _stack(frame) -> Optional[tuple]:
+        # Root first. Threads with no service frame on the stack (idle workers,
+        # the event loop waiting in select, the log listener) are skipped.
+        stack, ours = [], False
+        while frame is not None and len(stack) < 128:
+            code = frame.f_code
+            ours = ours or code.co_filename.startswith(SERVICE_DIR)
+            stack.append((code.co_name, code.co_filename, code.co_firstlineno))
+            frame = frame.f_back
+        return tuple(reversed(stack)) if ours else None
+
+def _frame_name(frame: tuple) -> str:
+    name, filename, line = frame
+    return f"{name} ({os.path.basename(filename)}:{line})"
+
+def _write_profile(directory: str, base: str, profile: RequestProfile, meta: dict):
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, base)
+    with open(path + ".collapsed", "w") as f:
+        for stack, count in sorted(profile.stacks.items(), key=lambda item: -item[1]):
+            f.write(";".join(_frame_name(frame).replace(";", ":") for frame in stack) + f" {count}\n")
+
+    frames, index = [], {}
+    def frame_id(key: tuple) -> int:
+        if key not in index:
+            index[key] = len(frames)
+            name, filename, line = key
+            frames.append({"name": name, "file": filename, "line": line} if filename else {"name": name})
+        return index[key]
+
+    interval_ms = profile.interval * 1000
+    stacks = list(profile.stacks.items())
+    sql = sorted(profile.statements, key=lambda item: -item[1])
+    speedscope = {
+        "$schema": "https://www.speedscope.app/file-format-schema.json",
+        "name": meta["request"],
+        "exporter": "showcase-launchpad helpers",
+        "shared": {"frames": frames},
+        "profiles": [
+            {
+                "type": "sampled", "name": f"{meta['request']} (stacks)", "unit": "milliseconds",
+                "startValue": 0, "endValue": sum(count for _, count in stacks) * interval_ms,
+                "samples": [[frame_id(frame) for frame in stack] for stack, _ in stacks],
+                "weights": [count * interval_ms for _, count in stacks],
+            },
+            {
+                "type": "sampled", "name": f"{meta['request']} (sqlite)", "unit": "milliseconds",
+                "startValue": 0, "endValue": sum(seconds for _, seconds in sql) * 1000,
+                "samples": [[frame_id(("sqlite", "", 0)), frame_id((" ".join(query.split())[:200], "", 0))] for query, _ in sql],
+                "weights": [seconds * 1000 for _, seconds in sql],
+            },
+        ],
+    }
+    with open(path + ".speedscope.json", "wb") as f:
+        f.write(json_dumps(speedscope))
+    meta["samples"] = sum(count for _, count in stacks)
+    meta["sql_ms"] = round(sum(seconds for _, seconds in sql) * 1000, 3)
+    meta["statements"] = [{"sql": " ".join(query.split()), "ms": round(seconds * 1000, 3)} for query, seconds in sql]
+    with open(path + ".meta.json", "wb") as f:
+        f.write(json_dumps(meta))
+
+    # Rotation: keep the newest PROFILE_KEEP profiles (names sort by time)
+    metas = sorted(name for name in os.listdir(directory) if name.endswith(".meta.json"))
+    for old in metas[:-PROFILE_KEEP] if PROFILE_KEEP > 0 else []:
+        old_base = old[:-len(".meta.json")]
+        for suffix in (".collapsed", ".speedscope.json", ".meta.json"):
+            try:
+                os.remove(os.path.join(directory, old_base + suffix))
+            except FileNotFoundError:
+                pass
+
+class ProfilingMiddleware:
+    def __init__(self, app, service: str, directory: Optional[str] = None):
+        self.app = app
+        self.service = service
+        self.directory = directory or f"../logs/{service}/profiles"
+        self.profiled = 0
+
+    async def _requested(self, scope) -> bool:
+        headers = dict(scope["headers"])
+        if headers.get(b"x-profile-request") == b"1":
+            try:
+                return await get_admin_access(headers.get(b"x-admin-api-key", b"").decode("latin-1"))
+            except HTTPException:
+                return False
+        if not PROFILE_ENABLED or random.random() >= PROFILE_SAMPLE_RATE:
+            return False
+        return not PROFILE_PATHS or any(scope["path"].startswith(prefix) for prefix in PROFILE_PATHS)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not await self._requested(scope) or not _profile_lock.acquire(blocking=False):
+            return await self.app(scope, receive, send)
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        profile = RequestProfile().start()
+        token = _active_profile.set(profile)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _active_profile.reset(token)
+            profile.stop()
+            _profile_lock.release()
+            route = getattr(scope.get("route"), "path", scope["path"])
+            duration_ms = profile.duration * 1000
+            stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S.%f")
+            slug = re.sub(r"[^A-Za-z0-9]+", "_", route).strip("_") or "root"
+            base = f"{stamp}-{scope['method']}-{slug}-{duration_ms:.0f}ms"
+            meta = {
+                "service": self.service,
+                "request": f"{scope['method']} {route}",
+                "path": scope["path"],
+                "query": scope.get("query_string", b"").decode("latin-1"),
+                "status": status,
+                "duration_ms": round(duration_ms, 3),
+                "interval_ms": profile.interval * 1000,
+            }
+            self.profiled += 1
+            await run_in_threadpool(_write_profile, self.directory, base, profile, meta)
+
+# --- SQLite Connection Pool ---
+_SQL_STATEMENTS = {"SELECT", "INSERT", "UPDATE", "DELETE", "REPLACE", "WITH", "BEGIN", "COMMIT", "ROLLBACK", "SAVEPOINT", "RELEASE", "PRAGMA", "CREATE"}
+_statement_re = re.compile(r"\s*(\w+)")
+_statement_kinds: Dict[str, str] = {}
+
+def _statement_kind(query: str) -> str:
+    # Queries are mostly constants, so the keyword is looked up once per string
+    kind = _statement_kinds.get(query)
+    if kind is None:
+        match = _statement_re.match(query)
+        kind = match.group(1).upper() if match else ""
+        if kind not in _SQL_STATEMENTS:
+            kind = "OTHER"
+        if len(_statement_kinds) < 4096:
+            _statement_kinds[query] = kind
+    return kind
+
+class TimedConnection(sqlite3.Connection):
+    # Feeds sqlite_query_duration_seconds. execute() runs the statement up to
+    # its first row, so rows fetched afterwards are not part of the timing.
+    def execute(self, query, params=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(query, params)
+        finally:
+            self._record(query, time.perf_counter() - started)
+
+    def executemany(self, query, seq_of_params):
+        started = time.perf_counter()
+        try:
+            return super().executemany(query, seq_of_params)
+        finally:
+            self._record(query, time.perf_counter() - started)
+
+    @staticmethod
+    def _record(query: str, seconds: float):
+        SQLITE_QUERY_SECONDS.observe(seconds, _statement_kind(query))
+        profile = _active_profile.get()
+        if profile is not None:
+            profile.statements.append((query, seconds))
+
+def connect_db(path: str, readonly: bool = False) -> sqlite3.Connection:
+    db = sqlite3.connect(path, check_same_thread=False, factory=TimedConnection if METRICS_SQLITE_TIMINGS else sqlite3.Connection)
     db.row_factory = sqlite3.Row
     db.execute("PRAGMA journal_mode=WAL;")
+    db.execute("PRAGMA synchronous=NORMAL;")
+    db.execute(f"PRAGMA cache_size=-{DB_CACHE_SIZE_KB};")
+    db.execute(f"PRAGMA mmap_size={DB_MMAP_SIZE};")
+    db.execute("PRAGMA temp_store=MEMORY;")
+    if readonly:
+        db.execute("PRAGMA query_only=ON;")
+    return db
+
+# Connections are opened once and reused, so the connect + PRAGMA round trip
+# is paid per connection instead of per request. Writers and read-only
+# readers live in separate pools so long reads never hold a write slot.
+class ConnectionPool:
+    def __init__(self, path: str, size: int, readonly: bool = False):
+        self.path = path
+        self.size = size
+        self.readonly = readonly
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._in_use = 0
+        self._counters = {"checkouts": 0, "waits": 0, "timeouts": 0, "recycled": 0, "rollbacks": 0}
+
+    def _connect(self) -> sqlite3.Connection:
+        return connect_db(self.path, readonly=self.readonly)
+
+    def _is_healthy(self, db: sqlite3.Connection) -> bool:
+        try:
+            db.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def acquire(self) -> sqlite3.Connection:
+        with self._lock:
+            self._counters["checkouts"] += 1
+            if self._idle.empty() and self._created < self.size:
+                self._created += 1
+                self._in_use += 1
+                create = True
+            else:
+                create = False
+        if create:
+            try:
+                return self._connect()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                    self._in_use -= 1
+                raise
+
+        try:
+            db, last_used = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                self._counters["waits"] += 1
+            try:
+                db, last_used = self._idle.get(timeout=DB_POOL_TIMEOUT)
+            except queue.Empty:
+                with self._lock:
+                    self._counters["timeouts"] += 1
+                raise HTTPException(status_code=503, detail="Database is busy, try again later.")
+        with self._lock:
+            self._in_use += 1
+
+        if time.monotonic() - last_used > DB_HEALTHCHECK_INTERVAL and not self._is_healthy(db):
+            with self._lock:
+                self._counters["recycled"] += 1
+            try:
+                db.close()
+            except sqlite3.Error:
+                pass
+            try:
+                db = self._connect()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                    self._in_use -= 1
+                raise
+        return db
+
+    def release(self, db: sqlite3.Connection):
+        # Endpoints may raise between safe_write and commit, never hand a
+        # half-finished transaction to the next request.
+        try:
+            if db.in_transaction:
+                db.rollback()
+                with self._lock:
+                    self._counters["rollbacks"] += 1
+            db.row_factory = sqlite3.Row
+        except sqlite3.Error:
+            with self._lock:
+                self._created -= 1
+                self._in_use -= 1
+                self._counters["recycled"] += 1
+            db.close()
+            return
+        with self._lock:
+            self._in_use -= 1
+        self._idle.put((db, time.monotonic()))
+
+    def close(self):
+        while True:
+            try:
+                db, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            db.close()
+            with self._lock:
+                self._created -= 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "path": self.path,
+                "readonly": self.readonly,
+                "size": self.size,
+                "created": self._created,
+                "in_use": self._in_use,
+                "idle": self._idle.qsize(),
+                **self._counters,
+            }
+
+_pools: Dict[tuple, ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+def get_pool(path: str = DB_PATH, readonly: bool = False) -> ConnectionPool:
+    key = (path, readonly)
+    pool = _pools.get(key)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None:
+                size = DB_POOL_SIZE if readonly else DB_WRITER_POOL_SIZE
+                pool = _pools[key] = ConnectionPool(path, size, readonly=readonly)
+    return pool
+
+def get_pool_stats() -> dict:
+    stats = {"writer" if not ro else "reader": pool.stats() for (_, ro), pool in list(_pools.items())}
+    for write_queue in list(_write_queues.values()):
+        stats["write_queue"] = write_queue.stats()
+    return stats
+
+def _pool_metric(counter: str) -> dict:
+    return {("reader" if ro else "writer",): pool.stats()[counter] for (_, ro), pool in list(_pools.items())}
+
+CallbackMetric("db_pool_in_use", "Checked out SQLite connections.", lambda: _pool_metric("in_use"), "gauge", ("pool",))
+CallbackMetric("db_pool_idle", "Idle SQLite connections.", lambda: _pool_metric("idle"), "gauge", ("pool",))
+CallbackMetric("db_pool_waits_total", "Checkouts that had to wait for a connection.", lambda: _pool_metric("waits"), "counter", ("pool",))
+CallbackMetric("db_pool_timeouts_total", "Checkouts that gave up with a 503.", lambda: _pool_metric("timeouts"), "counter", ("pool",))
+
+@atexit.register
+def close_pools():
+    for pool in list(_pools.values()):
+        pool.close()
+
+@contextmanager
+def pooled_connection(readonly: bool = False):
+    pool = get_pool(readonly=readonly)
+    db = pool.acquire()
     try:
         yield db
     finally:
+        pool.release(db)
+
+# --- SQLite WAL Mode and Retry ---
+def get_read_db():
+    with pooled_connection(readonly=True) as db:
+        yield db
+
+# --- Async SQLite Access ---
+# For async def endpoints: every sqlite call is handed to the threadpool, so a
+# slow query or a locked database never stalls the event loop. The connection
+# is checked out for the whole request, so its calls never overlap.
+class AsyncConnection:
+    def __init__(self, db: sqlite3.Connection):
+        self.db = db
+
+    async def run(self, fn: Callable, *args):
+        return await run_in_threadpool(fn, *args)
+
+    async def execute(self, query: str, params=()) -> sqlite3.Cursor:
+        return await run_in_threadpool(self.db.execute, query, params)
+
+    async def fetchone(self, query: str, params=()):
+        return await run_in_threadpool(lambda: self.db.execute(query, params).fetchone())
+
+    async def fetchall(self, query: str, params=()):
+        return await run_in_threadpool(lambda: self.db.execute(query, params).fetchall())
+
+async def _async_connection(readonly: bool):
+    pool = get_pool(readonly=readonly)
+    db = await run_in_threadpool(pool.acquire)
+    try:
+        yield AsyncConnection(db)
+    finally:
+        await run_in_threadpool(pool.release, db)
+
+async def get_async_read_db():
+    async for db in _async_connection(readonly=True):
+        yield db
+
+# --- Single-Writer Queue ---
+# One writer thread per database owns its own write connection. Write
+# operations are plain functions fn(db, *args) -> result; the writer drains
+# whatever is queued (waiting up to WRITE_BATCH_WINDOW for stragglers) and
+# runs the batch in one BEGIN IMMEDIATE ... COMMIT. Each operation gets its own
+# SAVEPOINT, so one failing operation (an IntegrityError, an HTTPException from
+# an ownership check) only rolls back itself. Results are handed back through
+# a Future once the group commit succeeded. Operations must not commit.
+class WriteQueue:
+    def __init__(self, path: str, window: float = WRITE_BATCH_WINDOW, max_batch: int = WRITE_BATCH_MAX):
+        self.path = path
+        self.window = window
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._counters = {"operations": 0, "failed": 0, "batches": 0, "failed_commits": 0, "max_batch_size": 0, "max_depth": 0}
+        self._commit_seconds = 0.0
+        self._thread = threading.Thread(target=self._run, name=f"sqlite-writer:{path}", daemon=True)
+        self._thread.start()
+
+    def submit(self, fn: Callable, *args) -> Future:
+        future = Future()
+        self._queue.put((fn, args, future))
+        depth = self._queue.qsize()
+        with self._lock:
+            if depth > self._counters["max_depth"]:
+                self._counters["max_depth"] = depth
+        return future
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join(timeout=5)
+
+    def _run(self):
+        db = connect_db(self.path)
+        db.isolation_level = None  # transactions are managed explicitly below
+        running = True
+        while running:
+            item = self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                try:
+                    item = self._queue.get(timeout=max(deadline - time.monotonic(), 0)) if self.window else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    running = False
+                    break
+                batch.append(item)
+            self._commit_batch(db, batch)
         db.close()
 
+    def _commit_batch(self, db: sqlite3.Connection, batch: list):
+        started = time.perf_counter()
+        outcomes = []
+        try:
+            safe_write(db, "BEGIN IMMEDIATE")
+            for fn, args, future in batch:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                db.execute("SAVEPOINT write_op")
+                try:
+                    outcomes.append((future, fn(db, *args), None))
+                    db.execute("RELEASE write_op")
+                except BaseException as e:
+                    db.execute("ROLLBACK TO write_op")
+                    db.execute("RELEASE write_op")
+                    outcomes.append((future, None, e))
+            db.execute("COMMIT")
+        except Exception as e:
+            if db.in_transaction:
+                db.execute("ROLLBACK")
+            with self._lock:
+                self._counters["failed_commits"] += 1
+            for fn, args, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        with self._lock:
+            self._counters["batches"] += 1
+            self._counters["operations"] += len(outcomes)
+            self._counters["failed"] += sum(1 for _, _, error in outcomes if error is not None)
+            self._counters["max_batch_size"] = max(self._counters["max_batch_size"], len(batch))
+            self._commit_seconds += time.perf_counter() - started
+        for future, result, error in outcomes:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    def stats(self) -> dict:
+        with self._lock:
+            batches = self._counters["batches"]
+            return {
+                "path": self.path,
+                "depth": self._queue.qsize(),
+                "window_ms": self.window * 1000,
+                "avg_batch_size": round(self._counters["operations"] / batches, 2) if batches else 0.0,
+                "avg_commit_ms": round(self._commit_seconds * 1000 / batches, 3) if batches else 0.0,
+                **self._counters,
+            }
+
+_write_queues: Dict[str, WriteQueue] = {}
+
+def _write_queue_metric(counter: str) -> dict:
+    return {(q.path,): q.stats()[counter] for q in list(_write_queues.values())}
+
+CallbackMetric("write_queue_depth", "Write operations waiting for the writer thread.", lambda: _write_queue_metric("depth"), "gauge", ("db",))
+CallbackMetric("write_queue_operations_total", "Write operations committed.", lambda: _write_queue_metric("operations"), "counter", ("db",))
+CallbackMetric("write_queue_batches_total", "Group commits.", lambda: _write_queue_metric("batches"), "counter", ("db",))
+CallbackMetric("write_queue_failed_commits_total", "Group commits that were rolled back.", lambda: _write_queue_metric("failed_commits"), "counter", ("db",))
+
+def get_write_queue(path: str = DB_PATH) -> WriteQueue:
+    write_queue = _write_queues.get(path)
+    if write_queue is None:
+        with _pools_lock:
+            write_queue = _write_queues.get(path)
+            if write_queue is None:
+                write_queue = _write_queues[path] = WriteQueue(path)
+    return write_queue
+
+@atexit.register
+def close_write_queues():
+    for write_queue in list(_write_queues.values()):
+        write_queue.close()
+
+def _write_direct(fn: Callable, *args):
+    with pooled_connection() as db:
+        safe_write(db, "BEGIN IMMEDIATE")
+        try:
+            result = fn(db, *args)
+            db.commit()
+        except BaseException:
+            db.rollback()
+            raise
+        return result
+
+def write(fn: Callable, *args):
+    # For def endpoints (already in the threadpool): block until committed
+    if WRITE_QUEUE_ENABLED:
+        return get_write_queue().submit(fn, *args).result()
+    return _write_direct(fn, *args)
+
+async def write_async(fn: Callable, *args):
+    if WRITE_QUEUE_ENABLED:
+        return await asyncio.wrap_future(get_write_queue().submit(fn, *args))
+    return await run_in_threadpool(_write_direct, fn, *args)
+
+# --- Background Jobs ---
+class PeriodicJob:
+    # Runs fn() on a daemon thread every `interval` seconds (first run right
+    # away) until stop() is called. Failures are logged and retried next tick.
+    def __init__(self, name: str, interval: float, fn: Callable, logger: Optional[logging.Logger] = None):
+        self.name = name
+        self.interval = interval
+        self.fn = fn
+        self.logger = logger or logging.getLogger(name)
+        self.runs = 0
+        self.failures = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=f"job:{self.name}", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout: Optional[float] = None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.fn()
+                self.runs += 1
+            except Exception as e:
+                self.failures += 1
+                self.logger.error("Background job '%s' failed: %s", self.name, e)
+            self._stop.wait(self.interval)
+
+# --- Streaming Responses ---
+# Rows are pulled from the cursor in fetchmany() batches and written out as
+# they are decoded, so exporting a whole table runs in constant memory.
+# The stream checks out its own reader connection: connections from get_db
+# are already back in the pool by the time the body is sent.
+def stream_query(sql: str, params=(), row_decoder: Callable = dict, fmt: str = "ndjson") -> StreamingResponse:
+    def generate():
+        with pooled_connection(readonly=True) as db:
+            cursor = db.execute(sql, params)
+            first = True
+            if fmt == "json":
+                yield b"["
+            while rows := cursor.fetchmany(STREAM_BATCH_SIZE):
+                chunk = []
+                for row in rows:
+                    encoded = json_dumps(row_decoder(row))
+                    if fmt == "json":
+                        chunk.append(encoded if first else b"," + encoded)
+                    else:
+                        chunk.append(encoded + b"\n")
+                    first = False
+                yield b"".join(chunk)
+            if fmt == "json":
+                yield b"]"
+
+    media_type = "application/json" if fmt == "json" else "application/x-ndjson"
+    return StreamingResponse(generate(), media_type=media_type)
+
 def safe_write(db, query: str, params=(), retries=3):
     for attempt in range(retries):
         try:
             return db.execute(query, params)
         except sqlite3.OperationalError as e:
-            if "locked" in str(e).lower() and attempt < retries - 1:
-                time.sleep(random.uniform(0.2, 0.5))
-            else:
+            if "locked" not in str(e).lower():
                 raise
+            if attempt == retries - 1:
+                SQLITE_WRITE_RETRIES_EXHAUSTED.inc(1, "sync")
+                raise
+            SQLITE_WRITE_RETRIES.inc(1, "sync")
+            time.sleep(random.uniform(0.2, 0.5))
+
+# --- In-Process Cache ---
+# LRU + TTL cache bounded by entry count and by an approximate byte budget
+# (callers pass the size of what they store). Entries can carry tags so a
+# write can drop exactly the entries it affects. The cache is per worker
+# process: other workers only see a write once their copy expires.
+class TTLCache:
+    def __init__(self, ttl: float = CACHE_TTL, max_entries: int = CACHE_MAX_ENTRIES, max_bytes: int = CACHE_MAX_BYTES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._tags: Dict[str, set] = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        # Bumped by every invalidation. A read-through load captures it before
+        # querying and passes it to set(), which drops the value if an
+        # invalidation landed meanwhile, so a slow stale load can't outlive it.
+        self._generation = 0
+        self._counters = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "invalidations": 0, "stale_loads": 0}
+
+    def _remove(self, key: Hashable):
+        _, _, size, tags = self._data.pop(key)
+        self._bytes -= size
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def get(self, key: Hashable, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self._counters["misses"] += 1
+                return default
+            if entry[1] <= time.monotonic():
+                self._remove(key)
+                self._counters["expirations"] += 1
+                self._counters["misses"] += 1
+                return default
+            self._data.move_to_end(key)
+            self._counters["hits"] += 1
+            return entry[0]
+
+    def generation(self) -> int:
+        return self._generation
+
+    def set(self, key: Hashable, value, size: int = 1, tags: Iterable[str] = (), ttl: Optional[float] = None,
+            generation: Optional[int] = None):
+        if size > self.max_bytes:
+            return
+        tags = frozenset(tags)
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                self._counters["stale_loads"] += 1
+                return
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = (value, time.monotonic() + (self.ttl if ttl is None else ttl), size, tags)
+            self._bytes += size
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._data) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._data)))
+                self._counters["evictions"] += 1
+
+    def invalidate(self, key: Hashable):
+        with self._lock:
+            self._generation += 1
+            if key in self._data:
+                self._remove(key)
+                self._counters["invalidations"] += 1
+
+    def invalidate_tags(self, *tags: str):
+        with self._lock:
+            self._generation += 1
+            for tag in tags:
+                for key in list(self._tags.get(tag, ())):
+                    self._remove(key)
+                    self._counters["invalidations"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._data.clear()
+            self._tags.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._counters["hits"] + self._counters["misses"]
+            return {
+                "entries": len(self._data),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "ttl": self.ttl,
+                "hit_ratio": round(self._counters["hits"] / lookups, 4) if lookups else 0.0,
+                **self._counters,
+            }
+
+# Verified JWT claims, keyed by token hash and expiring at the token's exp
+token_cache = TTLCache(max_entries=JWT_CACHE_MAX_ENTRIES)
+
+# --- Conditional Requests ---
+def make_etag(*parts) -> str:
+    digest = hashlib.sha1("\x1f".join(str(p) for p in parts).encode()).hexdigest()[:24]
+    return f'"{digest}"'
+
+def parse_db_timestamp(value: str) -> datetime:
+    # SQLite CURRENT_TIMESTAMP is UTC without an offset
+    return datetime.fromisoformat(value).replace(tzinfo=timezone.utc)
+
+def http_date(dt: datetime) -> str:
+    return format_datetime(dt.astimezone(timezone.utc), usegmt=True)
+
+def is_not_modified(request: Request, etag: str, last_modified: Optional[datetime] = None) -> bool:
+    # If-None-Match wins over If-Modified-Since (RFC 7232 section 6)
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        if if_none_match.strip() == "*":
+            return True
+        return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and last_modified is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+        return last_modified.replace(microsecond=0) <= since
+    return False
+
+def not_modified(etag: str, last_modified: Optional[datetime] = None) -> Response:
+    headers = {"ETag": etag}
+    if last_modified is not None:
+        headers["Last-Modified"] = http_date(last_modified)
+    return Response(status_code=304, headers=headers)
 
 # --- Real Client IP, works with and without Cloudflare ---
 def get_client_ip(request: Request) -> str:
     return request.headers.get("cf-connecting-ip") or request.headers.get("x-real-ip") or request.client.host
 
+# --- Rate Limiting ---
+class SQLiteLimiterStorage(Storage, SlidingWindowCounterSupport):
+    # `limits` storage shared by every uvicorn worker on the host through one
+    # small WAL database. A check is one UPSERT ... RETURNING, so the decision
+    # is atomic in SQLite without any lock in Python. slowapi runs checks on
+    # the event loop, so a locked database is waited on for RATE_LIMIT_TIMEOUT_MS
+    # at most and the request is then let through (fail open) instead of
+    # stalling the worker.
+    STORAGE_SCHEME = ["sqlite"]
+    SWEEP_PROBABILITY = 0.001
+
+    def __init__(self, uri: str, wrap_exceptions: bool = False, **options):
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+        path = uri.split("://", 1)[1]
+        self.path = path[1:] if path.startswith("/") else path
+        self.timeout = float(options.get("timeout", RATE_LIMIT_TIMEOUT_MS / 1000))
+        self._local = threading.local()
+        # startup may wait longer: every worker creates the table at once
+        conn = self._connection()
+        conn.execute("PRAGMA busy_timeout=5000")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS rate_limits ("
+            "key TEXT PRIMARY KEY, count INTEGER NOT NULL, expires_at REAL NOT NULL) WITHOUT ROWID"
+        )
+        conn.execute(f"PRAGMA busy_timeout={int(self.timeout * 1000)}")
+
+    @property
+    def base_exceptions(self):
+        return sqlite3.Error
+
+    def _connection(self) -> sqlite3.Connection:
+        # One connection per thread and per process, so forked workers never share a handle
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")  # counters only, losing them on power loss is fine
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def _execute(self, sql: str, params: tuple = ()) -> sqlite3.Cursor:
+        return self._connection().execute(sql, params)
+
+    @staticmethod
+    def _fail_open(e: sqlite3.OperationalError):
+        if "locked" not in str(e):
+            raise e
+        RATE_LIMIT_FAIL_OPEN.inc()
+
+    def _maybe_sweep(self, now: float):
+        if random.random() < self.SWEEP_PROBABILITY:
+            self._execute("DELETE FROM rate_limits WHERE expires_at <= ?", (now,))
+
+    def incr(self, key: str, expiry: int, amount: int = 1) -> int:
+        now = time.time()
+        try:
+            self._maybe_sweep(now)
+            return self._execute(
+                "INSERT INTO rate_limits (key, count, expires_at) VALUES (?1, ?2, ?3) "
+                "ON CONFLICT(key) DO UPDATE SET "
+                "count = CASE WHEN expires_at <= ?4 THEN excluded.count ELSE count + excluded.count END, "
+                "expires_at = CASE WHEN expires_at <= ?4 THEN excluded.expires_at ELSE expires_at END "
+                "RETURNING count",
+                (key, amount, now + expiry, now),
+            ).fetchone()[0]
+        except sqlite3.OperationalError as e:
+            self._fail_open(e)
+            return 0
+
+    def get(self, key: str) -> int:
+        row = self._connection().execute(
+            "SELECT count FROM rate_limits WHERE key = ? AND expires_at > ?", (key, time.time())
+        ).fetchone()
+        return row[0] if row else 0
+
+    def get_expiry(self, key: str) -> float:
+        row = self._connection().execute("SELECT expires_at FROM rate_limits WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else time.time()
+
+    def check(self) -> bool:
+        try:
+            self._connection().execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def reset(self) -> Optional[int]:
+        return self._execute("DELETE FROM rate_limits").rowcount
+
+    def clear(self, key: str) -> None:
+        self._execute("DELETE FROM rate_limits WHERE key = ?", (key,))
+
+    # Sliding window counter: the previous window is closed, so only the current one needs the atomic step
+    def acquire_sliding_window_entry(self, key: str, limit: int, expiry: int, amount: int = 1) -> bool:
+        if amount > limit:
+            return False
+        now = time.time()
+        previous_key, current_key = self.sliding_window_keys(key, expiry, now)
+        previous_count = self.get(previous_key)
+        previous_weight = previous_count * self._previous_ttl(previous_count, expiry, now) / expiry
+        if int(previous_weight) + amount > limit:
+            return False
+        try:
+            self._maybe_sweep(now)
+            # Same rule as the memory storage: floor(weighted count) + amount <= limit
+            row = self._execute(
+                "INSERT INTO rate_limits (key, count, expires_at) VALUES (?1, ?2, ?3) "
+                "ON CONFLICT(key) DO UPDATE SET count = count + excluded.count "
+                "WHERE ?4 + count + excluded.count < ?5 + 1 "
+                "RETURNING count",
+                (current_key, amount, now + 2 * expiry, previous_weight, limit),
+            ).fetchone()
+        except sqlite3.OperationalError as e:
+            self._fail_open(e)
+            return True
+        return row is not None
+
+    @staticmethod
+    def sliding_window_keys(key: str, expiry: int, at: float) -> tuple:
+        return f"{key}/{int((at - expiry) / expiry)}", f"{key}/{int(at / expiry)}"
+
+    @staticmethod
+    def _previous_ttl(previous_count: int, expiry: int, now: float) -> float:
+        return 0.0 if previous_count == 0 else (1 - (((now - expiry) / expiry) % 1)) * expiry
+
+    def get_sliding_window(self, key: str, expiry: int) -> tuple:
+        now = time.time()
+        previous_key, current_key = self.sliding_window_keys(key, expiry, now)
+        previous_count = self.get(previous_key)
+        current_ttl = (1 - ((now / expiry) % 1)) * expiry + expiry
+        return previous_count, self._previous_ttl(previous_count, expiry, now), self.get(current_key), current_ttl
+
+    def clear_sliding_window(self, key: str, expiry: int) -> None:
+        previous_key, current_key = self.sliding_window_keys(key, expiry, time.time())
+        self._execute("DELETE FROM rate_limits WHERE key IN (?, ?)", (previous_key, current_key))
+
+limiter = Limiter(
+    key_func=get_client_ip,
+    default_limits=["100/minute"],
+    storage_uri=RATE_LIMIT_STORAGE_URI,
+    strategy=RATE_LIMIT_STRATEGY,
+)
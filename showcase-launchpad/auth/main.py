@@ -2,20 +2,29 @@ import os
 import sqlite3
 import uuid
 import json
+import time
+import hmac
+import random
+import threading
+import base64
+import hashlib
+import secrets
+import binascii
 from datetime import datetime, timedelta, timezone
 from pathlib import Path
-from typing import Optional
+from string import Formatter
+from typing import Dict, List, Optional
 from dotenv import load_dotenv
 
 import resend
-from fastapi import FastAPI, Request, HTTPException, BackgroundTasks, Depends
+from fastapi import FastAPI, Request, HTTPException, Depends, Query
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, EmailStr, Field
 
-from helpers import create_jwt, setup_logger, limiter, get_current_user, AuthInfo, get_db, safe_write
+from helpers import create_jwt, setup_logger, limiter, get_current_user, get_admin_access, AuthInfo, get_async_read_db, AsyncConnection, write_async, get_pool_stats, token_cache, TTLCache, write, PeriodicJob, FastJSONResponse, json_loads, get_log_stats, MetricsMiddleware, metrics_response, ProfilingMiddleware
 
 load_dotenv()
-app = FastAPI(root_path="/v1/auth")
+app = FastAPI(root_path="/v1/auth", default_response_class=FastJSONResponse)
 
 # Add CORS middleware
 app.add_middleware(
@@ -25,6 +34,8 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(ProfilingMiddleware, service="auth")
+app.add_middleware(MetricsMiddleware)
 
 app.state.limiter = limiter
 logger = setup_logger("auth", f"../logs/auth/output.log")
@@ -32,6 +43,16 @@ resend.api_key = os.getenv("RESEND_API_KEY")
 FRONTEND_DOMAIN = os.getenv("FRONTEND_DOMAIN")
 DB_PATH = Path("users.db")
 
+# "table": random token stored in login_tokens (default)
+# "signed": stateless HMAC token carrying email + expiry, single use enforced via used_login_nonces
+LOGIN_TOKEN_MODE = os.getenv("LOGIN_TOKEN_MODE", "table").lower()
+LOGIN_TOKEN_TTL = timedelta(minutes=15)
+LOGIN_TOKEN_SWEEP_INTERVAL = float(os.getenv("LOGIN_TOKEN_SWEEP_INTERVAL", "300"))
+PROFILE_CACHE_TTL = float(os.getenv("PROFILE_CACHE_TTL", "10"))
+MAX_PROFILE_IDS = 100
+# derived so a magic-link signature can never be replayed as anything else signed with the same secret
+LOGIN_TOKEN_KEY = hashlib.sha256(b"magic-link:" + (os.getenv("LOGIN_TOKEN_SECRET") or os.getenv("JWT_SECRET", "default-secret-key")).encode()).digest()
+
 def init_db():
     with sqlite3.connect(DB_PATH) as db:
         db.execute("PRAGMA journal_mode=WAL;")
@@ -53,11 +74,87 @@ def init_db():
             expires_at DATETIME NOT NULL
         );
         """)
+        db.execute("""
+        CREATE TABLE IF NOT EXISTS used_login_nonces (
+            nonce BLOB PRIMARY KEY,
+            expires_at INTEGER NOT NULL
+        ) WITHOUT ROWID;
+        """)
+        db.execute("""
+        CREATE TABLE IF NOT EXISTS outbound_emails (
+            id INTEGER PRIMARY KEY,
+            recipient TEXT NOT NULL,
+            subject TEXT NOT NULL,
+            html TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL,
+            last_error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            sent_at TIMESTAMP
+        );
+        """)
         db.execute("CREATE INDEX IF NOT EXISTS idx_users_email ON users(email);")
         db.execute("CREATE INDEX IF NOT EXISTS idx_login_tokens_email ON login_tokens(email);")
+        db.execute("CREATE INDEX IF NOT EXISTS idx_login_tokens_expires ON login_tokens(expires_at);")
+        db.execute("CREATE INDEX IF NOT EXISTS idx_used_login_nonces_expires ON used_login_nonces(expires_at);")
+        db.execute("CREATE INDEX IF NOT EXISTS idx_outbound_emails_due ON outbound_emails(status, next_attempt_at);")
         logger.info("Auth database initialized with users and login_tokens tables.")
 init_db()
 
+# --- LOGIN TOKENS ---
+
+def _b64encode(raw: bytes) -> str:
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+
+def _b64decode(value: str) -> bytes:
+    return base64.urlsafe_b64decode(value + "=" * (-len(value) % 4))
+
+def _sign(body: bytes) -> bytes:
+    return hmac.new(LOGIN_TOKEN_KEY, body, hashlib.sha256).digest()[:16]
+
+def create_signed_token(email: str, expires: datetime) -> str:
+    # 16 byte nonce | 4 byte expiry (unix seconds) | email, then a truncated HMAC-SHA256
+    body = secrets.token_bytes(16) + int(expires.timestamp()).to_bytes(4, "big") + email.encode()
+    return f"{_b64encode(body)}.{_b64encode(_sign(body))}"
+
+def read_signed_token(token: str):
+    try:
+        body_b64, mac_b64 = token.split(".")
+        body, mac = _b64decode(body_b64), _b64decode(mac_b64)
+    except (ValueError, binascii.Error):
+        raise HTTPException(status_code=404, detail="Token not found or already used.")
+    if len(body) <= 20 or not hmac.compare_digest(mac, _sign(body)):
+        raise HTTPException(status_code=404, detail="Token not found or already used.")
+    return body[:16], int.from_bytes(body[16:20], "big"), body[20:].decode()
+
+def find_or_create_user(db: sqlite3.Connection, email: str):
+    user = db.execute("SELECT id FROM users WHERE email = ?", (email,)).fetchone()
+    if user:
+        return user['id'], False
+    new_user_id = str(uuid.uuid4())
+    db.execute(
+        "INSERT INTO users (id, email, display_name) VALUES (?, ?, ?)",
+        (new_user_id, email, email.split('@')[0])
+    )
+    return new_user_id, True
+
+def sweep_expired_rows():
+    now = datetime.now(timezone.utc)
+
+    def delete_expired(db: sqlite3.Connection):
+        tokens = db.execute("DELETE FROM login_tokens WHERE expires_at < ?", (now.isoformat(),)).rowcount
+        nonces = db.execute("DELETE FROM used_login_nonces WHERE expires_at < ?", (int(now.timestamp()),)).rowcount
+        emails = db.execute(
+            "DELETE FROM outbound_emails WHERE status != 'pending' AND created_at < datetime('now', ?)",
+            (f"-{MAIL_RETENTION_DAYS} days",)
+        ).rowcount
+        return tokens, nonces, emails
+
+    tokens, nonces, emails = write(delete_expired)
+    if tokens or nonces or emails:
+        logger.info("Swept %s expired login tokens, %s used nonces and %s finished emails.", tokens, nonces, emails)
+
 # --- MODELS ---
 
 class LoginRequest(BaseModel):
@@ -80,37 +177,215 @@ class ProfileUpdate(BaseModel):
     bio: Optional[str] = None
     social: Optional[dict] = None
 
-# --- SEND EMAIL ---
+class PublicProfile(BaseModel):
+    display_name: Optional[str] = None
+    profile_photo: Optional[str] = None
+    bio: Optional[str] = None
+    social: Optional[dict] = None
 
-def send_login_email(email: str, token: str):
-    if not resend.api_key:
-        logger.error("Resend API key is not configured. Cannot send email.")
-        return
-    try:
-        # use this if you want to use your own frontend domain-> verify_url = f"https://{FRONTEND_DOMAIN}/verify-login?token={token}"
-        verify_url = f"https://launchpad.kcstudio.nl/verify-login?token={token}"
-
-        # load from external template
-        template_path = Path(__file__).parent / "email_template.html"
-        with open(template_path, "r") as f:
-            html = f.read()
-
-        # replace placeholders
-        html = html.format(
-            verify_url=verify_url,
-            frontend=os.getenv("FRONTEND_DOMAIN", "PROJECT_NAME")
+class PublicProfiles(BaseModel):
+    profiles: Dict[str, PublicProfile]
+    missing: List[str]
+
+# --- PUBLIC PROFILES ---
+# Short-lived per-user cache; PUT /me and /delete-me invalidate their own entry.
+profile_cache = TTLCache(ttl=PROFILE_CACHE_TTL)
+
+async def load_public_profiles(db: AsyncConnection, user_ids: List[str]) -> Dict[str, dict]:
+    profiles, misses = {}, []
+    for user_id in user_ids:
+        profile = profile_cache.get(user_id)
+        if profile is None:
+            misses.append(user_id)
+        else:
+            profiles[user_id] = profile
+    if misses:
+        rows = await db.fetchall(
+            "SELECT id, display_name, profile_photo, bio, social FROM users WHERE id IN (SELECT value FROM json_each(?))",
+            (json.dumps(misses),)
         )
+        for row in rows:
+            profile = {
+                "display_name": row["display_name"],
+                "profile_photo": row["profile_photo"],
+                "bio": row["bio"],
+                "social": json_loads(row["social"]) if row["social"] else row["social"],
+            }
+            profile_cache.set(row["id"], profile)
+            profiles[row["id"]] = profile
+    return profiles
 
-        params = {
-            "from": f"Login <{os.getenv('RESEND_FROM_EMAIL')}>",
-            "to": [email],
-            "subject": "Your Magic Link to Log In",
-            "html": html,
-        }
-        resend.Emails.send(params)
-        logger.info(f"Magic link sent to {email}.")
-    except Exception as e:
-        logger.error(f"Failed to send email to {email}: {e}")
+# --- SEND EMAIL ---
+# Login emails go through a durable queue in users.db. /login only inserts a
+# row, in the same transaction as the login token; a small worker pool claims
+# due rows in batches, hands them to the transport and reschedules failures
+# with exponential backoff. Claiming a row leases it (next_attempt_at is
+# pushed forward by MAIL_LEASE), so a batch lost in a crash is sent again.
+
+MAIL_TRANSPORT = os.getenv("MAIL_TRANSPORT", "resend").lower()  # "resend" or "stub"
+MAIL_WORKERS = int(os.getenv("MAIL_WORKERS", "2"))
+MAIL_BATCH_SIZE = min(int(os.getenv("MAIL_BATCH_SIZE", "50")), 100)  # Resend batch API limit
+MAIL_MAX_ATTEMPTS = int(os.getenv("MAIL_MAX_ATTEMPTS", "6"))
+MAIL_RETRY_BASE = float(os.getenv("MAIL_RETRY_BASE", "5"))
+MAIL_RETRY_MAX = float(os.getenv("MAIL_RETRY_MAX", "900"))
+MAIL_LEASE = float(os.getenv("MAIL_LEASE", "60"))
+MAIL_POLL_INTERVAL = float(os.getenv("MAIL_POLL_INTERVAL", "2"))
+MAIL_RETENTION_DAYS = int(os.getenv("MAIL_RETENTION_DAYS", "7"))
+MAIL_FROM = f"Login <{os.getenv('RESEND_FROM_EMAIL')}>"
+
+def compile_template(path: Path):
+    # Parsed once: rendering is a join over the literal chunks and fields
+    parts = list(Formatter().parse(path.read_text()))
+
+    def render(**values) -> str:
+        return "".join(literal + (str(values[field]) if field is not None else "") for literal, field, _, _ in parts)
+    return render
+
+render_login_email = compile_template(Path(__file__).parent / "email_template.html")
+
+class ResendTransport:
+    def send_batch(self, messages: list):
+        if not resend.api_key:
+            raise RuntimeError("Resend API key is not configured.")
+        if len(messages) == 1:
+            resend.Emails.send(messages[0])
+        else:
+            resend.Batch.send(messages)
+
+class StubTransport:
+    # Local stand-in for tests and benchmarks: keeps messages instead of sending them
+    def __init__(self, latency: float = 0.0, fail_rate: float = 0.0):
+        self.latency = latency
+        self.fail_rate = fail_rate
+        self.sent = []
+
+    def send_batch(self, messages: list):
+        if self.latency:
+            time.sleep(self.latency)
+        if self.fail_rate and random.random() < self.fail_rate:
+            raise RuntimeError("Stub transport failure.")
+        self.sent.extend(messages)
+
+TRANSPORTS = {
+    "resend": ResendTransport,
+    "stub": lambda: StubTransport(latency=float(os.getenv("MAIL_STUB_LATENCY_MS", "0")) / 1000),
+}
+
+class MailQueue:
+    def __init__(self, transport, workers: int = MAIL_WORKERS, batch_size: int = MAIL_BATCH_SIZE):
+        self.transport = transport
+        self.workers = workers
+        self.batch_size = batch_size
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+        self._lock = threading.Lock()
+        self._counters = {"sent": 0, "retried": 0, "failed": 0, "batches": 0}
+
+    def enqueue(self, db: sqlite3.Connection, recipient: str, subject: str, html: str):
+        # Runs inside the caller's write operation; call notify() after it committed
+        db.execute(
+            "INSERT INTO outbound_emails (recipient, subject, html, next_attempt_at) VALUES (?, ?, ?, ?)",
+            (recipient, subject, html, time.time())
+        )
+
+    def notify(self):
+        self._wakeup.set()
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"mail-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self, timeout: Optional[float] = None):
+        self._stop.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _claim(self):
+        now = time.time()
+        return write(lambda db: db.execute("""
+            UPDATE outbound_emails SET attempts = attempts + 1, next_attempt_at = ?
+            WHERE id IN (
+                SELECT id FROM outbound_emails WHERE status = 'pending' AND next_attempt_at <= ?
+                ORDER BY next_attempt_at LIMIT ?
+            )
+            RETURNING id, recipient, subject, html, attempts
+        """, (now + MAIL_LEASE, now, self.batch_size)).fetchall())
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                batch = self._claim()
+                if batch:
+                    self._deliver(batch)
+                    continue
+            except Exception as e:
+                logger.error("Mail worker error: %s", e)
+            self._wakeup.wait(MAIL_POLL_INTERVAL)
+            self._wakeup.clear()
+
+    def _deliver(self, batch: list):
+        messages = [
+            {"from": MAIL_FROM, "to": [row["recipient"]], "subject": row["subject"], "html": row["html"]}
+            for row in batch
+        ]
+        try:
+            self.transport.send_batch(messages)
+            error = None
+        except Exception as e:
+            error = str(e)
+
+        now = time.time()
+        if error is None:
+            write(lambda db: db.executemany(
+                "UPDATE outbound_emails SET status = 'sent', sent_at = CURRENT_TIMESTAMP, last_error = NULL WHERE id = ?",
+                [(row["id"],) for row in batch]
+            ))
+            logger.info("Sent %s queued emails.", len(batch))
+        else:
+            updates = []
+            for row in batch:
+                if row["attempts"] >= MAIL_MAX_ATTEMPTS:
+                    updates.append(("failed", now, error, row["id"]))
+                    logger.error("Giving up on email %s to %s after %s attempts: %s", row['id'], row['recipient'], row['attempts'], error)
+                else:
+                    delay = min(MAIL_RETRY_MAX, MAIL_RETRY_BASE * 2 ** (row["attempts"] - 1))
+                    updates.append(("pending", now + delay * random.uniform(0.5, 1.0), error, row["id"]))
+            write(lambda db: db.executemany(
+                "UPDATE outbound_emails SET status = ?, next_attempt_at = ?, last_error = ? WHERE id = ?", updates
+            ))
+            failed = sum(1 for status, *_ in updates if status == "failed")
+            logger.warning("Failed to send %s queued emails (%s rescheduled): %s", len(batch), len(batch) - failed, error)
+
+        with self._lock:
+            self._counters["batches"] += 1
+            if error is None:
+                self._counters["sent"] += len(batch)
+            else:
+                self._counters["failed"] += failed
+                self._counters["retried"] += len(batch) - failed
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"workers": len(self._threads), "batch_size": self.batch_size, **self._counters}
+
+def enqueue_login_email(db: sqlite3.Connection, email: str, token: str):
+    # use this if you want to use your own frontend domain-> verify_url = f"https://{FRONTEND_DOMAIN}/verify-login?token={token}"
+    verify_url = f"https://launchpad.kcstudio.nl/verify-login?token={token}"
+    html = render_login_email(verify_url=verify_url, frontend=os.getenv("FRONTEND_DOMAIN", "PROJECT_NAME"))
+    mail_queue.enqueue(db, email, "Your Magic Link to Log In", html)
+
+if MAIL_TRANSPORT not in TRANSPORTS:
+    raise ValueError(f"Unknown MAIL_TRANSPORT '{MAIL_TRANSPORT}', expected one of {', '.join(TRANSPORTS)}")
+if MAIL_TRANSPORT == "resend" and not resend.api_key:
+    logger.error("Resend API key is not configured. Queued emails will be retried until it is.")
+mail_queue = MailQueue(TRANSPORTS[MAIL_TRANSPORT]()).start()
+sweeper = PeriodicJob("auth-sweeper", LOGIN_TOKEN_SWEEP_INTERVAL, sweep_expired_rows, logger).start()
 
 # --- ROUTES ---
 
@@ -118,58 +393,92 @@ def send_login_email(email: str, token: str):
 def health():
     return {"status": "auth is healthy"}
 
+@app.get("/db-pool")
+def db_pool_stats(_ = Depends(get_admin_access)):
+    return get_pool_stats()
+
+@app.get("/metrics")
+def metrics(_ = Depends(get_admin_access)):
+    return metrics_response()
+
+@app.get("/log-stats")
+def log_stats(_ = Depends(get_admin_access)):
+    return get_log_stats()
+
+@app.get("/cache-stats")
+def cache_stats(_ = Depends(get_admin_access)):
+    return {"jwt": token_cache.stats(), "profiles": profile_cache.stats()}
+
+@app.get("/mail-queue")
+async def mail_queue_stats(_ = Depends(get_admin_access), db: AsyncConnection = Depends(get_async_read_db)):
+    rows = await db.fetchall("SELECT status, COUNT(*) AS count FROM outbound_emails GROUP BY status")
+    return {**mail_queue.stats(), "emails": {row["status"]: row["count"] for row in rows}}
+
 @app.post("/login")
 @limiter.limit("5/minute")
-async def login(request: Request, body: LoginRequest, background_tasks: BackgroundTasks, db: sqlite3.Connection = Depends(get_db)):
-    token, expires = str(uuid.uuid4()), datetime.now(timezone.utc) + timedelta(minutes=15)
-    safe_write(db, "INSERT INTO login_tokens (token, email, expires_at) VALUES (?, ?, ?)",
-                   (token, body.email.lower(), expires.isoformat()))
-    db.commit()
-    
-    background_tasks.add_task(send_login_email, body.email.lower(), token)
+async def login(request: Request, body: LoginRequest):
+    email, expires = body.email.lower(), datetime.now(timezone.utc) + LOGIN_TOKEN_TTL
+
+    def create_login(db: sqlite3.Connection):
+        if LOGIN_TOKEN_MODE == "signed":
+            token = create_signed_token(email, expires)
+        else:
+            token = str(uuid.uuid4())
+            db.execute("INSERT INTO login_tokens (token, email, expires_at) VALUES (?, ?, ?)",
+                       (token, email, expires.isoformat()))
+        enqueue_login_email(db, email, token)
+
+    await write_async(create_login)
+    mail_queue.notify()
     return {"message": "Magic link sent to your email."}
 
 @app.post("/verify")
 @limiter.limit("10/minute")
 
-async def verify(request: Request, body: VerifyRequest, db: sqlite3.Connection = Depends(get_db)):
-    db.row_factory = sqlite3.Row
-    result = db.execute("SELECT email, expires_at FROM login_tokens WHERE token = ?", (body.token,)).fetchone()
-    if not result:
-        raise HTTPException(status_code=404, detail="Token not found or already used.")
-    email = result['email']
-    if datetime.now(timezone.utc) > datetime.fromisoformat(result['expires_at']):
-        safe_write(db, "DELETE FROM login_tokens WHERE token = ?", (body.token,))
-        db.commit()
-        raise HTTPException(status_code=400, detail="Token has expired.")
-    safe_write(db, "DELETE FROM login_tokens WHERE token = ?", (body.token,))
-
-    user = db.execute("SELECT * FROM users WHERE email = ?", (email,)).fetchone()
-    if not user:
-        new_user_id = str(uuid.uuid4())
-        safe_write(db,
-            "INSERT INTO users (id, email, display_name) VALUES (?, ?, ?)",
-            (new_user_id, email, email.split('@')[0])
-        )
-        user_id = new_user_id
-        logger.info(f"New user created: {email} with ID {user_id}")
+async def verify(request: Request, body: VerifyRequest):
+    def consume_token(db: sqlite3.Connection):
+        result = db.execute("SELECT email, expires_at FROM login_tokens WHERE token = ?", (body.token,)).fetchone()
+        if not result:
+            raise HTTPException(status_code=404, detail="Token not found or already used.")
+        email = result['email']
+        db.execute("DELETE FROM login_tokens WHERE token = ?", (body.token,))
+        if datetime.now(timezone.utc) > datetime.fromisoformat(result['expires_at']):
+            # Not raised here: raising would roll back the token delete
+            return email, None, False
+        return email, *find_or_create_user(db, email)
+
+    def consume_signed_token(db: sqlite3.Connection, nonce: bytes, expires_at: int, email: str):
+        try:
+            db.execute("INSERT INTO used_login_nonces (nonce, expires_at) VALUES (?, ?)", (nonce, expires_at))
+        except sqlite3.IntegrityError:
+            raise HTTPException(status_code=404, detail="Token not found or already used.")
+        return email, *find_or_create_user(db, email)
+
+    # signed tokens contain a ".", table tokens are UUIDs; both are accepted so switching modes keeps sent links valid
+    if "." in body.token:
+        nonce, expires_at, email = read_signed_token(body.token)
+        if time.time() > expires_at:
+            raise HTTPException(status_code=400, detail="Token has expired.")
+        email, user_id, created = await write_async(consume_signed_token, nonce, expires_at, email)
     else:
-        user_id = user['id']
-    db.commit()
+        email, user_id, created = await write_async(consume_token)
+    if user_id is None:
+        raise HTTPException(status_code=400, detail="Token has expired.")
+    if created:
+        logger.info("New user created: %s with ID %s", email, user_id)
 
     jwt_payload = {"sub": user_id, "email": email}
     session_jwt = create_jwt(jwt_payload)
     return {"access_token": session_jwt, "token_type": "bearer"}
 
 @app.get("/me", response_model=UserProfile)
-async def get_me(request: Request, current_user: AuthInfo = Depends(get_current_user), db: sqlite3.Connection = Depends(get_db)):
-    db.row_factory = sqlite3.Row
-    user = db.execute("SELECT * FROM users WHERE id = ?", (current_user.user_id,)).fetchone()
+async def get_me(request: Request, current_user: AuthInfo = Depends(get_current_user), db: AsyncConnection = Depends(get_async_read_db)):
+    user = await db.fetchone("SELECT * FROM users WHERE id = ?", (current_user.user_id,))
     if not user:
         raise HTTPException(status_code=404, detail="User not found.")
     user_dict = dict(user)
     if user_dict.get("social"):
-        user_dict["social"] = json.loads(user_dict["social"])
+        user_dict["social"] = json_loads(user_dict["social"])
     return user_dict
 
 @app.put("/me", response_model=UserProfile)
@@ -177,7 +486,6 @@ async def update_me(
     request: Request,
     update_data: ProfileUpdate,
     current_user: AuthInfo = Depends(get_current_user),
-    db: sqlite3.Connection = Depends(get_db)
 ):
     update_fields = update_data.dict(exclude_unset=True)
     if not update_fields:
@@ -196,51 +504,49 @@ async def update_me(
 
     params.append(current_user.user_id)
     
-    sql_query = f"UPDATE users SET {', '.join(set_clauses)} WHERE id = ?"
-
-    db.row_factory = sqlite3.Row
-    safe_write(db, sql_query, tuple(params))
-    db.commit()
+    sql_query = f"UPDATE users SET {', '.join(set_clauses)} WHERE id = ? RETURNING *"
 
-    user = db.execute("SELECT * FROM users WHERE id = ?", (current_user.user_id,)).fetchone()
+    user = await write_async(lambda db: db.execute(sql_query, tuple(params)).fetchone())
+    profile_cache.invalidate(current_user.user_id)
     if not user:
-        logger.warning(f"User with ID {current_user.user_id} was not found after update. Possible race condition or data inconsistency.")
+        logger.warning("User with ID %s was not found after update. Possible race condition or data inconsistency.", current_user.user_id)
         raise HTTPException(status_code=404, detail="User not found after update.")
             
     user_dict = dict(user)
     if user_dict.get("social"):
-        user_dict["social"] = json.loads(user_dict["social"])
-    logger.info(f"User profile updated for {current_user.email} with fields: {list(update_fields.keys())}")
+        user_dict["social"] = json_loads(user_dict["social"])
+    logger.info("User profile updated for %s with fields: %s", current_user.email, list(update_fields.keys()))
     return user_dict
 
 @app.get("/public-profile/{user_id}")
 @limiter.limit("30/minute")
-async def public_profile(request: Request, user_id: str, db: sqlite3.Connection = Depends(get_db)):
-    db.row_factory = sqlite3.Row
-    user = db.execute(
-        "SELECT display_name, profile_photo, bio, social FROM users WHERE id = ?",
-        (user_id,)
-    ).fetchone()
-    if not user:
+async def public_profile(request: Request, user_id: str, db: AsyncConnection = Depends(get_async_read_db)):
+    profile = (await load_public_profiles(db, [user_id])).get(user_id)
+    if not profile:
         raise HTTPException(status_code=404, detail="User not found")
+    return profile
 
-    user_dict = dict(user)
-    if user_dict.get("social"):
-        user_dict["social"] = json.loads(user_dict["social"])
-    return {
-        "display_name": user_dict["display_name"],
-        "profile_photo": user_dict["profile_photo"],
-        "bio": user_dict["bio"],
-        "social": user_dict["social"]
-    }
+@app.get("/public-profiles", response_model=PublicProfiles)
+@limiter.limit("30/minute")
+async def public_profiles(
+    request: Request,
+    ids: List[str] = Query(..., min_length=1, max_length=MAX_PROFILE_IDS),
+    db: AsyncConnection = Depends(get_async_read_db)
+):
+    user_ids = list(dict.fromkeys(ids))
+    profiles = await load_public_profiles(db, user_ids)
+    return {"profiles": profiles, "missing": [user_id for user_id in user_ids if user_id not in profiles]}
 
 @app.delete("/delete-me", status_code=200)
 @limiter.limit("5/minute")
-async def delete_me(request: Request, current_user: AuthInfo = Depends(get_current_user), db: sqlite3.Connection = Depends(get_db)):
-    safe_write(db, "DELETE FROM users WHERE id = ?", (current_user.user_id,))
-    safe_write(db, "DELETE FROM login_tokens WHERE email = ?", (current_user.email,))
-    db.commit()
-    logger.info(f"User {current_user.email} deleted their profile.")
+async def delete_me(request: Request, current_user: AuthInfo = Depends(get_current_user)):
+    def delete_user(db: sqlite3.Connection):
+        db.execute("DELETE FROM users WHERE id = ?", (current_user.user_id,))
+        db.execute("DELETE FROM login_tokens WHERE email = ?", (current_user.email,))
+
+    await write_async(delete_user)
+    profile_cache.invalidate(current_user.user_id)
+    logger.info("User %s deleted their profile.", current_user.email)
     return { "message": "Your profile has been deleted." }
     
 
@@ -0,0 +1,83 @@
+"""Per-check overhead of the rate limiter storages in helpers.
+
+Times SlidingWindowCounterRateLimiter.hit() (what slowapi runs per request)
+against memory://, the SQLite storage on disk and on /dev/shm, single process
+and with several worker processes hitting the same database at once. With
+fewer cores than --workers the multi-process mean/p99 mostly measure the OS
+scheduler; p50 is the per-check cost.
+
+    python benchmarks/limiter.py [--checks 20000] [--workers 4]
+"""
+import argparse
+import multiprocessing as mp
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "database"))
+os.environ.setdefault("RATE_LIMIT_STORAGE_URI", "memory://")  # keep the import from creating ./ratelimit.db
+
+from limits import parse
+from limits.storage import storage_from_string
+from limits.strategies import SlidingWindowCounterRateLimiter
+
+import helpers  # noqa: F401  registers the sqlite:// scheme
+
+LIMIT = parse("1000000/minute")
+KEYS = 1000  # distinct client IPs
+
+
+def run_checks(uri: str, checks: int) -> list:
+    strategy = SlidingWindowCounterRateLimiter(storage_from_string(uri))
+    samples = []
+    for i in range(checks):
+        key = f"10.0.{i % KEYS // 256}.{i % 256}"
+        start = time.perf_counter_ns()
+        strategy.hit(LIMIT, key, "/bench")
+        samples.append(time.perf_counter_ns() - start)
+    return samples
+
+
+def worker(uri: str, checks: int, out):
+    out.put(run_checks(uri, checks))
+
+
+def report(name: str, samples: list):
+    samples.sort()
+    p = lambda q: samples[min(len(samples) - 1, int(len(samples) * q))] / 1000
+    print(f"{name:<28} mean {statistics.fmean(samples) / 1000:7.1f} us   p50 {p(0.50):7.1f} us   p99 {p(0.99):7.1f} us")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--checks", type=int, default=20000)
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+
+    disk_dir = tempfile.mkdtemp(prefix="limiter-bench-")
+    shm_dir = tempfile.mkdtemp(prefix="limiter-bench-", dir="/dev/shm") if os.path.isdir("/dev/shm") else None
+    targets = [("memory", "memory://"), ("sqlite disk", f"sqlite:///{disk_dir}/ratelimit.db")]
+    if shm_dir:
+        targets.append(("sqlite /dev/shm", f"sqlite:///{shm_dir}/ratelimit.db"))
+
+    for name, uri in targets:
+        run_checks(uri, 1000)  # warm up, creates the table
+        report(f"{name}, 1 process", run_checks(uri, args.checks))
+        if uri.startswith("memory"):
+            continue  # nothing shared across processes
+        ctx = mp.get_context("spawn")
+        out = ctx.Queue()
+        procs = [ctx.Process(target=worker, args=(uri, args.checks, out)) for _ in range(args.workers)]
+        for proc in procs:
+            proc.start()
+        samples = [s for _ in procs for s in out.get()]
+        for proc in procs:
+            proc.join()
+        report(f"{name}, {args.workers} processes", samples)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,546 @@
+"""Load test for auth, app, database and storage with a realistic request mix.
+
+Every run works on a throwaway copy of the services: temp SQLite files, a
+seeded data.db, MAIL_TRANSPORT=stub and random X-Real-IP per request so the
+per-client rate limits don't cap the load. Two ways to run the services:
+
+    ports      one uvicorn per service on a free local port (real HTTP, --workers each)
+    inprocess  one child process per service, requests go through httpx.ASGITransport
+               (no sockets; RSS then includes that service's share of the load generator)
+
+Virtual users run a closed loop, picking operations by weight from MIX, for
+--duration seconds after --warmup. Reported per operation: throughput, p50/p99
+and errors; per service: RSS at start, peak and end.
+
+    python benchmarks/loadtest.py --users 32 --duration 30
+    python benchmarks/loadtest.py --items 1000000 --save-baseline benchmarks/baselines/local.json
+    python benchmarks/loadtest.py --compare benchmarks/baselines/local.json --fail-on-regression
+
+Needs httpx (already pulled in by FastAPI's TestClient) and the services' requirements.
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing as mp
+import os
+import platform
+import random
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+import jwt
+
+ROOT = Path(__file__).resolve().parent.parent
+BENCHMARKS = Path(__file__).resolve().parent
+SERVICES = {"auth": "users.db", "app": "app.db", "database": "data.db", "storage": "storage.db"}
+JWT_SECRET = "bench-secret"
+ADMIN_API_KEY = "bench-admin"
+BENCH_USERS = 200
+UPLOAD_SIZES = {"upload_4k": 4 * 1024, "upload_256k": 256 * 1024, "upload_4m": 4 * 1024 * 1024}
+
+# operation -> (service, weight)
+MIX = {
+    "listpublic": ("database", 25),
+    "search": ("database", 12),
+    "retrieve": ("database", 12),
+    "create": ("database", 6),
+    "update": ("database", 4),
+    "delete": ("database", 2),
+    "login_verify": ("auth", 3),
+    "me": ("auth", 5),
+    "public_info": ("app", 8),
+    "secret_data": ("app", 4),
+    "upload_4k": ("storage", 5),
+    "upload_256k": ("storage", 3),
+    "upload_4m": ("storage", 1),
+    "download": ("storage", 8),
+    "download_range": ("storage", 2),
+}
+
+WORDS = ["launch", "rocket", "orbit", "studio", "design", "gallery", "project", "brand", "video", "cloud", "search", "coffee"]
+TYPES = ["article", "project", "gallery", "video", "note", "product"]
+CATEGORIES = ["design", "engineering", "marketing", "photography", "music", "travel", "food", "misc"]
+
+# --- Environment ---
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def prepare_workdir(workdir: Path, items: int, data_db: str = None):
+    for service in SERVICES:
+        shutil.copytree(ROOT / service, workdir / service,
+                        ignore=shutil.ignore_patterns("__pycache__", "*.db", "*.db-*", "files"))
+        (workdir / "logs" / service).mkdir(parents=True, exist_ok=True)
+    if data_db:
+        shutil.copy(data_db, workdir / "database" / "data.db")
+    elif items:
+        with open(workdir / "logs" / "database" / "seed.log", "wb") as log:
+            subprocess.run([sys.executable, str(BENCHMARKS / "seed.py"), "--dir", str(workdir / "database"), "--items", str(items)],
+                           check=True, stdout=log, stderr=subprocess.STDOUT)
+
+def service_env(service: str) -> dict:
+    return {
+        **os.environ,
+        "DB_PATH": SERVICES[service],
+        "JWT_SECRET": JWT_SECRET,
+        "ADMIN_API_KEY": ADMIN_API_KEY,
+        "MAIL_TRANSPORT": "stub",
+        "RESEND_API_KEY": "",
+        "PYTHONUNBUFFERED": "1",
+    }
+
+def rss_bytes(pid: int) -> int:
+    # The process and its children (uvicorn workers)
+    total = 0
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    total += int(line.split()[1]) * 1024
+        for task in os.listdir(f"/proc/{pid}/task"):
+            with open(f"/proc/{pid}/task/{task}/children") as f:
+                total += sum(rss_bytes(int(child)) for child in f.read().split())
+    except (OSError, ValueError):
+        pass
+    return total
+
+class RSSMonitor:
+    def __init__(self, pids: dict):
+        self.pids = pids
+        self.start = {name: rss_bytes(pid) for name, pid in pids.items()}
+        self.peak = dict(self.start)
+
+    def sample(self):
+        for name, pid in self.pids.items():
+            self.peak[name] = max(self.peak[name], rss_bytes(pid))
+
+    def report(self) -> dict:
+        mib = 1024 * 1024
+        return {
+            name: {"rss_start_mb": round(self.start[name] / mib, 1), "rss_peak_mb": round(self.peak[name] / mib, 1),
+                   "rss_end_mb": round(rss_bytes(pid) / mib, 1)}
+            for name, pid in self.pids.items()
+        }
+
+# --- Workload ---
+
+class Recorder:
+    def __init__(self):
+        self.samples = {}
+        self.errors = {}
+        self.recording = False
+
+    def record(self, name: str, seconds: float, ok: bool):
+        if not self.recording:
+            return
+        self.samples.setdefault(name, []).append(seconds)
+        if not ok:
+            self.errors[name] = self.errors.get(name, 0) + 1
+
+class VirtualUser:
+    def __init__(self, uid: int, clients: dict, recorder: Recorder, auth_db: Path, seeded_items: int, seed: int):
+        self.uid = uid
+        self.clients = clients
+        self.recorder = recorder
+        self.auth_db = auth_db
+        self.seeded_items = seeded_items
+        self.rng = random.Random(seed * 100003 + uid)
+        user = f"bench-user-{uid % BENCH_USERS}"
+        token = jwt.encode({"sub": user, "email": f"{user}@launchpad-bench.dev", "exp": int(time.time()) + 86400}, JWT_SECRET, algorithm="HS256")
+        self.auth = {"Authorization": f"Bearer {token}"}
+        self.items = []
+        self.files = []
+        self.counter = 0
+
+    def headers(self, auth: bool = False) -> dict:
+        headers = {"X-Real-IP": f"10.{self.rng.randrange(256)}.{self.rng.randrange(256)}.{self.rng.randrange(1, 255)}"}
+        if auth:
+            headers.update(self.auth)
+        return headers
+
+    async def call(self, name: str, service: str, method: str, url: str, ok=(200, 201, 204, 206, 304), **kwargs):
+        started = time.perf_counter()
+        try:
+            response = await self.clients[service].request(method, url, **kwargs)
+            status = response.status_code
+        except httpx.HTTPError:
+            response, status = None, 0
+        self.recorder.record(name, time.perf_counter() - started, status in ok)
+        return response
+
+    def word(self) -> str:
+        return self.rng.choice(WORDS)
+
+    # --- database ---
+    async def listpublic(self):
+        params = {"limit": 20}
+        if self.rng.random() < 0.5:
+            params["type"] = self.rng.choice(TYPES)
+        if self.rng.random() < 0.3:
+            params["category"] = self.rng.choice(CATEGORIES)
+        if self.rng.random() < 0.2:
+            params["keyword"] = self.word()
+        response = await self.call("listpublic", "database", "GET", "/listpublic", params=params, headers=self.headers())
+        cursor = response is not None and response.status_code == 200 and response.json().get("next_cursor")
+        if cursor and self.rng.random() < 0.3:
+            await self.call("listpublic", "database", "GET", "/listpublic", params={**params, "cursor": cursor}, headers=self.headers())
+
+    async def search(self):
+        keyword = " ".join(self.word() for _ in range(self.rng.randint(1, 2)))
+        await self.call("search", "database", "GET", "/search", params={"keyword": keyword, "limit": 20}, headers=self.headers())
+
+    async def retrieve(self):
+        if not self.seeded_items:
+            return await self.listpublic()
+        slug = f"seed-{self.rng.randrange(self.seeded_items):09d}"
+        # drafts and archived items are a legitimate 404
+        await self.call("retrieve", "database", "GET", f"/retrieve/{slug}", ok=(200, 304, 404), headers=self.headers())
+
+    def item_body(self) -> dict:
+        return {
+            "title": " ".join(self.word() for _ in range(3)).title(),
+            "type": self.rng.choice(TYPES),
+            "category": self.rng.choice(CATEGORIES),
+            "tags": self.rng.sample(WORDS, 2),
+            "status": "published",
+            "data": {"description": " ".join(self.word() for _ in range(30)), "views": self.rng.randrange(1000)},
+        }
+
+    async def create(self):
+        self.counter += 1
+        slug = f"bench-{os.getpid()}-{self.uid}-{self.counter}"
+        response = await self.call("create", "database", "POST", "/create", json={"slug": slug, **self.item_body()}, headers=self.headers(True))
+        if response is not None and response.status_code == 201:
+            self.items.append(slug)
+
+    async def update(self):
+        if not self.items:
+            return await self.create()
+        slug = self.rng.choice(self.items)
+        await self.call("update", "database", "PUT", f"/update/{slug}", json=self.item_body(), headers=self.headers(True))
+
+    async def delete(self):
+        if not self.items:
+            return await self.create()
+        slug = self.items.pop(self.rng.randrange(len(self.items)))
+        await self.call("delete", "database", "DELETE", f"/delete/{slug}", headers=self.headers(True))
+
+    # --- auth ---
+    async def login_verify(self):
+        self.counter += 1
+        email = f"login-{os.getpid()}-{self.uid}-{self.counter}@launchpad-bench.dev"
+        response = await self.call("login", "auth", "POST", "/login", json={"email": email}, headers=self.headers())
+        if response is None or response.status_code != 200:
+            return
+        with sqlite3.connect(f"file:{self.auth_db}?mode=ro", uri=True) as db:
+            row = db.execute("SELECT token FROM login_tokens WHERE email = ?", (email,)).fetchone()
+        if row:
+            await self.call("verify", "auth", "POST", "/verify", json={"token": row[0]}, headers=self.headers())
+
+    async def me(self):
+        # bench users never verified, so 404 is the expected answer after a valid JWT check
+        await self.call("me", "auth", "GET", "/me", ok=(200, 404), headers=self.headers(True))
+
+    # --- app ---
+    async def public_info(self):
+        await self.call("public_info", "app", "GET", "/public-info", headers=self.headers())
+
+    async def secret_data(self):
+        await self.call("secret_data", "app", "GET", "/user/secret-data", headers=self.headers(True))
+
+    # --- storage ---
+    async def upload(self, name: str):
+        # unique bytes per upload so the dedup store really writes every file
+        body = os.urandom(16) + PAYLOADS[name]
+        response = await self.call(name, "storage", "POST", "/upload/raw", params={"filename": f"{name}.bin"},
+                                   content=body, headers={**self.headers(True), "Content-Type": "application/octet-stream"})
+        if response is not None and response.status_code == 200:
+            self.files.append(response.json()["id"])
+
+    async def download(self, ranged: bool = False):
+        if not self.files:
+            return await self.upload("upload_4k")
+        file_id = self.rng.choice(self.files)
+        headers = self.headers()
+        name = "download"
+        if ranged:
+            headers["Range"] = "bytes=0-1023"
+            name = "download_range"
+        await self.call(name, "storage", "GET", f"/download/{file_id}", headers=headers)
+
+    async def run_op(self, op: str):
+        if op in UPLOAD_SIZES:
+            return await self.upload(op)
+        if op == "download_range":
+            return await self.download(ranged=True)
+        return await getattr(self, op)()
+
+PAYLOADS = {name: os.urandom(size) for name, size in UPLOAD_SIZES.items()}
+
+async def drive(clients: dict, ops: dict, users: int, warmup: float, duration: float, seed: int,
+                auth_db: Path, seeded_items: int, on_tick=None, uid_offset: int = 0) -> Recorder:
+    recorder = Recorder()
+    names, weights = list(ops), [ops[name] for name in ops]
+    deadline = time.monotonic() + warmup + duration
+
+    async def user_loop(uid: int):
+        user = VirtualUser(uid, clients, recorder, auth_db, seeded_items, seed)
+        while time.monotonic() < deadline:
+            await user.run_op(user.rng.choices(names, weights)[0])
+
+    async def clock():
+        await asyncio.sleep(warmup)
+        recorder.recording = True
+        while time.monotonic() < deadline:
+            if on_tick:
+                on_tick()
+            await asyncio.sleep(0.5)
+
+    await asyncio.gather(clock(), *(user_loop(uid_offset + i) for i in range(users)))
+    return recorder
+
+# --- Runners ---
+
+def wait_healthy(url: str, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(url, timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up, see the service log in the work dir")
+
+def run_ports(args, workdir: Path, seeded_items: int):
+    procs, clients = {}, {}
+    try:
+        for service in SERVICES:
+            port = free_port()
+            log = open(workdir / "logs" / service / "uvicorn.log", "wb")
+            procs[service] = subprocess.Popen(
+                [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+                 "--workers", str(args.workers), "--log-level", "warning", "--no-access-log"],
+                cwd=workdir / service, env=service_env(service), stdout=log, stderr=subprocess.STDOUT,
+            )
+            clients[service] = f"http://127.0.0.1:{port}"
+        for base in clients.values():
+            wait_healthy(f"{base}/health")
+
+        monitor = RSSMonitor({service: proc.pid for service, proc in procs.items()})
+        ops = {op: weight for op, (service, weight) in MIX.items() if service in args.services}
+
+        async def main():
+            limits = httpx.Limits(max_connections=args.users * 2, max_keepalive_connections=args.users * 2)
+            async with httpx.AsyncClient(limits=limits, timeout=60) as client:
+                http = {service: _Prefixed(client, base) for service, base in clients.items()}
+                return await drive(http, ops, args.users, args.warmup, args.duration, args.seed,
+                                   workdir / "auth" / "users.db", seeded_items, monitor.sample)
+
+        recorder = asyncio.run(main())
+        return recorder.samples, recorder.errors, monitor.report()
+    finally:
+        for proc in procs.values():
+            proc.terminate()
+        for proc in procs.values():
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+
+class _Prefixed:
+    # One pooled client shared by all services, each call gets its base URL
+    def __init__(self, client: httpx.AsyncClient, base: str):
+        self.client = client
+        self.base = base
+
+    async def request(self, method: str, url: str, **kwargs):
+        return await self.client.request(method, self.base + url, **kwargs)
+
+def _inprocess_child(service: str, workdir: str, args: dict, seeded_items: int, uid_offset: int, out):
+    os.chdir(Path(workdir) / service)
+    os.environ.update(service_env(service))
+    sys.path.insert(0, os.getcwd())
+    import main as service_main
+
+    ops = {op: weight for op, (svc, weight) in MIX.items() if svc == service}
+
+    async def run():
+        transport = httpx.ASGITransport(app=service_main.app, client=("127.0.0.1", 12345))
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+            monitor = RSSMonitor({service: os.getpid()})
+            recorder = await drive({service: client}, ops, args["users"], args["warmup"], args["duration"], args["seed"],
+                                   Path(workdir) / "auth" / "users.db", seeded_items, monitor.sample, uid_offset)
+            return recorder, monitor.report()
+
+    recorder, rss = asyncio.run(run())
+    out.put((recorder.samples, recorder.errors, rss))
+
+def run_inprocess(args, workdir: Path, seeded_items: int):
+    # Users are split across services by the weight of their share of MIX
+    total = sum(weight for service, weight in MIX.values() if service in args.services)
+    ctx = mp.get_context("spawn")
+    out = ctx.Queue()
+    procs = []
+    for i, service in enumerate(args.services):
+        share = sum(weight for svc, weight in MIX.values() if svc == service) / total
+        child_args = {"users": max(1, round(args.users * share)), "warmup": args.warmup, "duration": args.duration, "seed": args.seed}
+        proc = ctx.Process(target=_inprocess_child, args=(service, str(workdir), child_args, seeded_items, i * 10000, out))
+        proc.start()
+        procs.append(proc)
+    samples, errors, rss = {}, {}, {}
+    for _ in procs:
+        s, e, r = out.get()
+        samples.update(s)
+        errors.update(e)
+        rss.update(r)
+    for proc in procs:
+        proc.join()
+    return samples, errors, rss
+
+# --- Reporting ---
+
+def percentile(sorted_values: list, q: float) -> float:
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * q))]
+
+def summarize(samples: dict, errors: dict, duration: float) -> dict:
+    ops = {}
+    for name in sorted(samples):
+        values = sorted(samples[name])
+        ops[name] = {
+            "count": len(values),
+            "rps": round(len(values) / duration, 2),
+            "p50_ms": round(percentile(values, 0.50) * 1000, 2),
+            "p99_ms": round(percentile(values, 0.99) * 1000, 2),
+            "max_ms": round(values[-1] * 1000, 2),
+            "errors": errors.get(name, 0),
+        }
+    everything = sorted(v for values in samples.values() for v in values)
+    total = {
+        "count": len(everything),
+        "rps": round(len(everything) / duration, 2),
+        "p50_ms": round(percentile(everything, 0.50) * 1000, 2) if everything else 0.0,
+        "p99_ms": round(percentile(everything, 0.99) * 1000, 2) if everything else 0.0,
+        "errors": sum(errors.values()),
+    }
+    return {"ops": ops, "total": total}
+
+def print_report(result: dict):
+    print(f"\n{'operation':<16}{'count':>8}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}{'errors':>8}")
+    for name, op in result["ops"].items():
+        print(f"{name:<16}{op['count']:>8}{op['rps']:>10.1f}{op['p50_ms']:>10.2f}{op['p99_ms']:>10.2f}{op['max_ms']:>10.2f}{op['errors']:>8}")
+    total = result["total"]
+    print(f"{'TOTAL':<16}{total['count']:>8}{total['rps']:>10.1f}{total['p50_ms']:>10.2f}{total['p99_ms']:>10.2f}{'':>10}{total['errors']:>8}")
+    print(f"\n{'service':<16}{'RSS start':>12}{'peak':>10}{'end':>10}  (MiB)")
+    for name, rss in result["services"].items():
+        print(f"{name:<16}{rss['rss_start_mb']:>12.1f}{rss['rss_peak_mb']:>10.1f}{rss['rss_end_mb']:>10.1f}")
+
+def compare(result: dict, baseline: dict, tolerance: float) -> list:
+    # Returns the regressions beyond tolerance (%), printing every delta
+    regressions = []
+
+    def delta(label: str, new: float, old: float, higher_is_better: bool):
+        if not old:
+            return
+        change = (new - old) / old * 100
+        worse = -change if higher_is_better else change
+        flag = "  REGRESSION" if worse > tolerance else ""
+        if flag:
+            regressions.append(label)
+        print(f"  {label:<34}{old:>10.2f} -> {new:>10.2f}  {change:+7.1f}%{flag}")
+
+    print(f"\nCompared with baseline from {baseline['meta'].get('date', '?')} (tolerance {tolerance}%):")
+    for key in ("mode", "users", "workers", "duration", "items", "services", "cpus"):
+        if baseline["meta"].get(key) != result["meta"].get(key):
+            print(f"  warning: {key} differs ({baseline['meta'].get(key)} vs {result['meta'].get(key)}), figures are not comparable")
+    for name, op in result["ops"].items():
+        old = baseline["ops"].get(name)
+        if old:
+            delta(f"{name} req/s", op["rps"], old["rps"], True)
+            delta(f"{name} p50 ms", op["p50_ms"], old["p50_ms"], False)
+            delta(f"{name} p99 ms", op["p99_ms"], old["p99_ms"], False)
+    delta("TOTAL req/s", result["total"]["rps"], baseline["total"]["rps"], True)
+    for name, rss in result["services"].items():
+        old = baseline["services"].get(name)
+        if old:
+            delta(f"{name} RSS peak MiB", rss["rss_peak_mb"], old["rss_peak_mb"], False)
+    return regressions
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return ""
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mode", choices=("ports", "inprocess"), default="ports")
+    parser.add_argument("--services", default=",".join(SERVICES), help="comma separated subset of auth,app,database,storage")
+    parser.add_argument("--users", type=int, default=16, help="concurrent virtual users")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers per service (ports mode)")
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--warmup", type=float, default=3)
+    parser.add_argument("--items", type=int, default=20000, help="items seeded into data.db")
+    parser.add_argument("--data-db", help="use a copy of an already seeded data.db instead of seeding")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--workdir", help="keep the services' files and logs here instead of a temp dir")
+    parser.add_argument("--save-baseline", help="write the results as JSON")
+    parser.add_argument("--compare", help="baseline JSON to diff against")
+    parser.add_argument("--tolerance", type=float, default=10, help="allowed regression in percent")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    args = parser.parse_args()
+    args.services = [s.strip() for s in args.services.split(",") if s.strip()]
+
+    workdir = Path(args.workdir or tempfile.mkdtemp(prefix="launchpad-bench-")).resolve()
+    workdir.mkdir(parents=True, exist_ok=True)
+    print(f"Preparing services in {workdir} ...")
+    prepare_workdir(workdir, 0 if args.data_db else args.items, args.data_db)
+    seeded_items = args.items
+    if args.data_db:
+        with sqlite3.connect(workdir / "database" / "data.db") as db:
+            seeded_items = db.execute("SELECT count(*) FROM items WHERE slug LIKE 'seed-%'").fetchone()[0]
+
+    print(f"Running {args.mode} mode: {args.users} users, {args.warmup:g}s warmup + {args.duration:g}s ...")
+    runner = run_ports if args.mode == "ports" else run_inprocess
+    samples, errors, rss = runner(args, workdir, seeded_items)
+
+    result = summarize(samples, errors, args.duration)
+    result["services"] = rss
+    result["meta"] = {
+        "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "mode": args.mode,
+        "users": args.users,
+        "workers": args.workers,
+        "duration": args.duration,
+        "items": seeded_items,
+        "services": args.services,
+        "seed": args.seed,
+    }
+    print_report(result)
+
+    if args.save_baseline:
+        Path(args.save_baseline).parent.mkdir(parents=True, exist_ok=True)
+        Path(args.save_baseline).write_text(json.dumps(result, indent=2) + "\n")
+        print(f"\nBaseline written to {args.save_baseline}")
+    if not args.workdir:
+        shutil.rmtree(workdir, ignore_errors=True)
+    if args.compare:
+        regressions = compare(result, json.loads(Path(args.compare).read_text()), args.tolerance)
+        if regressions and args.fail_on_regression:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
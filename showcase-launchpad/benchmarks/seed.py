@@ -0,0 +1,114 @@
+"""Fills a database service data.db with generated items.
+
+The schema comes from database/main.py itself (imported with its cwd set to
+--dir), so the seeded file always matches the service. Rows go in with the FTS
+triggers dropped and the full-text index is rebuilt once at the end, which
+keeps millions of rows to minutes instead of hours.
+
+    python benchmarks/seed.py --dir /tmp/bench/database --items 2000000
+    python benchmarks/seed.py --dir database --items 100000 --owners 500   # the repo's own data.db
+
+--dir must be a service directory: the item table lives in <dir>/data.db and
+the service logs to <dir>/../logs/database/.
+"""
+import argparse
+import json
+import os
+import random
+import sqlite3
+import sys
+import time
+from pathlib import Path
+
+DATABASE_SERVICE = Path(__file__).resolve().parent.parent / "database"
+
+WORDS = (
+    "launch pad rocket orbit studio design portfolio showcase gallery project case study brand "
+    "identity motion video photo web app mobile api cloud data search cache index stream upload "
+    "audio print poster campaign product release notes guide tutorial recipe travel city coffee "
+    "garden ocean mountain winter summer night light color shape type grid layout sketch render"
+).split()
+TYPES = ["article", "project", "gallery", "video", "note", "product"]
+CATEGORIES = ["design", "engineering", "marketing", "photography", "music", "travel", "food", "misc"]
+STATUSES = ["published"] * 7 + ["draft"] * 2 + ["archived"]
+
+def sentence(rng: random.Random, n: int) -> str:
+    return " ".join(rng.choices(WORDS, k=n))
+
+def generate_items(rng: random.Random, start: int, count: int, owners: int, now: float):
+    for i in range(start, start + count):
+        # CURRENT_TIMESTAMP format, spread over the last year
+        stamp = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(now - rng.randrange(365 * 24 * 3600)))
+        data = {
+            "description": sentence(rng, rng.randint(12, 40)),
+            "summary": sentence(rng, 8),
+            "views": rng.randrange(100000),
+            "featured": rng.random() < 0.05,
+        }
+        yield (
+            f"user-{rng.randrange(owners):06d}",
+            f"seed-{i:09d}",
+            sentence(rng, rng.randint(2, 6)).title(),
+            rng.choice(TYPES),
+            rng.choice(CATEGORIES),
+            json.dumps(rng.sample(WORDS, rng.randint(0, 4))),
+            rng.choice(STATUSES),
+            json.dumps(data),
+            stamp,
+            stamp,
+        )
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dir", required=True, help="service directory holding data.db")
+    parser.add_argument("--items", type=int, default=100000)
+    parser.add_argument("--owners", type=int, default=1000)
+    parser.add_argument("--batch", type=int, default=50000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    workdir = Path(args.dir).resolve()
+    workdir.mkdir(parents=True, exist_ok=True)
+    (workdir.parent / "logs" / "database").mkdir(parents=True, exist_ok=True)
+    os.chdir(workdir)
+    os.environ.setdefault("DB_PATH", "data.db")
+    os.environ.setdefault("RATE_LIMIT_STORAGE_URI", "memory://")
+    sys.path.insert(0, str(DATABASE_SERVICE))
+    import main as database  # creates the schema and FTS table in ./data.db
+
+    rng = random.Random(args.seed)
+    now = time.time()
+    db = sqlite3.connect("data.db", isolation_level=None)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=OFF")
+    db.execute("PRAGMA cache_size=-262144")
+    start = db.execute("SELECT count(*) FROM items WHERE slug LIKE 'seed-%'").fetchone()[0]
+    for trigger in ("items_fts_ai", "items_fts_ad", "items_fts_au"):
+        db.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+
+    started, done = time.perf_counter(), 0
+    while done < args.items:
+        count = min(args.batch, args.items - done)
+        db.execute("BEGIN")
+        db.executemany(
+            "INSERT INTO items (owner_id, slug, title, type, category, tags, status, data, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            generate_items(rng, start + done, count, args.owners, now),
+        )
+        db.execute("COMMIT")
+        done += count
+        rate = done / (time.perf_counter() - started)
+        print(f"\r{done:,}/{args.items:,} items ({rate:,.0f}/s)", end="", flush=True)
+    print()
+
+    fts_started = time.perf_counter()
+    db.execute("BEGIN")
+    indexed = database.rebuild_fts(db)  # also puts the triggers back
+    db.execute("COMMIT")
+    db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    db.execute("ANALYZE")
+    db.close()
+    print(f"Full-text index rebuilt for {indexed:,} items in {time.perf_counter() - fts_started:.1f}s")
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,23 @@
 import os
 import sqlite3
 import json
+import base64
+import re
+import sys
+import html
+from functools import partial
 from pathlib import Path
-from typing import List, Optional
-from datetime import datetime
+from typing import List, Optional, Literal, Union
 from dotenv import load_dotenv
 
 from fastapi import FastAPI, Depends, HTTPException, Request, Query
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, ValidationError
 
-from helpers import get_current_user, get_admin_access, setup_logger, limiter, AuthInfo, get_db, safe_write
+from helpers import get_current_user, get_admin_access, setup_logger, limiter, AuthInfo, get_read_db, get_pool_stats, token_cache, write, write_async, stream_query, TTLCache, make_etag, parse_db_timestamp, http_date, is_not_modified, not_modified, FastJSONResponse, json_loads, json_column, RAW_JSON_COLUMNS, get_log_stats, MetricsMiddleware, metrics_response, ProfilingMiddleware
 
 load_dotenv()
-app = FastAPI(root_path="/v1/database")
+app = FastAPI(root_path="/v1/database", default_response_class=FastJSONResponse)
 
 # CORS
 app.add_middleware(
@@ -23,13 +27,106 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(ProfilingMiddleware, service="database")
+app.add_middleware(MetricsMiddleware)
 
 app.state.limiter = limiter
 logger = setup_logger("database", f"../logs/database/output.log")
 DB_PATH = Path("data.db")
+MAX_PAGE_SIZE = 200
+BULK_MAX_OPS = int(os.getenv("BULK_MAX_OPS", "5000"))
+BULK_CHUNK_SIZE = 500  # rows per multi-row statement, far below SQLite's bound parameter limit
+FTS_DATA_FIELDS = [f.strip() for f in os.getenv("FTS_DATA_FIELDS", "description,summary,content,body,text").split(",") if f.strip()]
+
+# --- Full-Text Search ---
+# items_fts mirrors title, slug, tags and selected `data` fields of every item
+# (rowid = items.id) and is kept in sync by triggers on items.
+
+def _fts_columns(prefix: str) -> str:
+    for field in FTS_DATA_FIELDS:
+        if not re.fullmatch(r"[A-Za-z0-9_]+", field):
+            raise ValueError(f"Invalid FTS_DATA_FIELDS entry: {field!r}")
+    tags = f"CASE WHEN json_valid({prefix}tags) THEN (SELECT group_concat(value, ' ') FROM json_each({prefix}tags)) END"
+    body = " || ' ' || ".join(f"coalesce(json_extract({prefix}data, '$.{f}'), '')" for f in FTS_DATA_FIELDS) or "''"
+    body = f"CASE WHEN json_valid({prefix}data) THEN trim({body}) END"
+    return f"{prefix}id, {prefix}title, {prefix}slug, {tags}, {body}"
+
+def _create_fts_triggers(db: sqlite3.Connection, replace: bool = False):
+    # Startup only adds missing triggers, so workers starting together never
+    # race on DROP/CREATE. rebuild_fts replaces them to pick up FTS_DATA_FIELDS.
+    if replace:
+        for trigger in ("items_fts_ai", "items_fts_ad", "items_fts_au"):
+            db.execute(f"DROP TRIGGER IF EXISTS {trigger};")
+    db.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS items_fts_ai AFTER INSERT ON items BEGIN
+        INSERT INTO items_fts (rowid, title, slug, tags, body) VALUES ({_fts_columns("new.")});
+    END;
+    """)
+    db.execute("""
+    CREATE TRIGGER IF NOT EXISTS items_fts_ad AFTER DELETE ON items BEGIN
+        DELETE FROM items_fts WHERE rowid = old.id;
+    END;
+    """)
+    db.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS items_fts_au AFTER UPDATE ON items BEGIN
+        DELETE FROM items_fts WHERE rowid = old.id;
+        INSERT INTO items_fts (rowid, title, slug, tags, body) VALUES ({_fts_columns("new.")});
+    END;
+    """)
+
+def rebuild_fts(db: sqlite3.Connection) -> int:
+    # Also the way to apply a changed FTS_DATA_FIELDS: python main.py rebuild-fts
+    _create_fts_triggers(db, replace=True)
+    db.execute("DELETE FROM items_fts;")
+    db.execute(f"INSERT INTO items_fts (rowid, title, slug, tags, body) SELECT {_fts_columns('')} FROM items;")
+    db.execute("INSERT INTO items_fts (items_fts) VALUES ('optimize');")
+    return db.execute("SELECT count(*) FROM items_fts").fetchone()[0]
+
+def init_fts(db: sqlite3.Connection):
+    # One worker creates and backfills the index, the others wait on the
+    # write lock and then find the table already there.
+    db.commit()
+    db.execute("BEGIN IMMEDIATE;")
+    try:
+        exists = db.execute("SELECT 1 FROM sqlite_master WHERE name = 'items_fts'").fetchone()
+        db.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS items_fts USING fts5(
+            title, slug, tags, body,
+            tokenize = 'unicode61 remove_diacritics 2',
+            prefix = '2 3'
+        );
+        """)
+        if exists:
+            _create_fts_triggers(db)
+        else:
+            # First start on an existing data.db, backfill what is already there
+            count = rebuild_fts(db)
+            logger.info("Full-text index created and backfilled with %s items.", count)
+        db.commit()
+    except BaseException:
+        db.rollback()
+        raise
+
+def fts_query(keyword: str) -> Optional[str]:
+    # Quote every term so user input can never be parsed as FTS5 syntax, and
+    # make each term a prefix match ("laun" finds "launchpad").
+    terms = [t.replace('"', '""') for t in keyword.split()]
+    if not terms:
+        return None
+    return " ".join(f'"{t}"*' for t in terms)
+
+# snippet() marks matches with control characters; the text is HTML-escaped
+# first and only then are the markers turned into <mark> tags.
+SNIPPET_START, SNIPPET_END = "\x02", "\x03"
+
+def highlight_snippet(snippet: Optional[str]) -> Optional[str]:
+    if snippet is None:
+        return None
+    return html.escape(snippet).replace(SNIPPET_START, "<mark>").replace(SNIPPET_END, "</mark>")
 
 def init_db():
-    with sqlite3.connect(DB_PATH) as db:
+    # Generous timeout: other workers may hold the write lock while backfilling items_fts
+    with sqlite3.connect(DB_PATH, timeout=600) as db:
         db.execute("PRAGMA journal_mode=WAL;")
         db.execute("""
         CREATE TABLE IF NOT EXISTS items (
@@ -52,7 +149,11 @@ def init_db():
         db.execute("CREATE INDEX IF NOT EXISTS idx_items_type ON items(type);")
         db.execute("CREATE INDEX IF NOT EXISTS idx_items_category ON items(category);")
         db.execute("CREATE INDEX IF NOT EXISTS idx_items_created_at ON items(created_at);")
+        # Keyset pagination walks (created_at, id); id is the rowid so every index already ends with it
+        db.execute("CREATE INDEX IF NOT EXISTS idx_items_owner_created ON items(owner_id, created_at);")
+        db.execute("CREATE INDEX IF NOT EXISTS idx_items_status_created ON items(status, created_at);")
         logger.info("Database indexes created.")
+        init_fts(db)
 init_db()
 
 # --- Models ---
@@ -79,6 +180,14 @@ class ItemCreate(BaseModel):
     status: Optional[str] = "draft"
     data: Optional[dict] = {}
 
+class ItemPage(BaseModel):
+    items: List[Item]
+    next_cursor: Optional[str] = None
+
+class PublicItemPage(BaseModel):
+    items: List[dict]
+    next_cursor: Optional[str] = None
+
 class ItemUpdate(BaseModel):
     title: Optional[str]
     type: Optional[str]
@@ -87,17 +196,133 @@ class ItemUpdate(BaseModel):
     status: Optional[str] = "draft"
     data: Optional[dict] = {}
 
+class BulkOperation(BaseModel):
+    op: Literal["create", "update", "delete"]
+    slug: str = Field(..., min_length=3)
+    title: Optional[str] = None
+    type: Optional[str] = None
+    category: Optional[str] = None
+    tags: Optional[List[str]] = []
+    status: Optional[str] = "draft"
+    data: Optional[dict] = {}
+
+class BulkResult(BaseModel):
+    index: int
+    op: Optional[str] = None
+    slug: Optional[str] = None
+    status: int
+    item: Optional[Item] = None
+    detail: Optional[str] = None
+
+class BulkResponse(BaseModel):
+    results: List[BulkResult]
+    created: int
+    updated: int
+    deleted: int
+    failed: int
+
+# Read endpoints return FastJSONResponse directly: rows come straight from
+# our own schema, so re-validating them against response_model is wasted work,
+# and with RAW_JSON_COLUMNS the stored tags/data text is echoed unparsed.
+def decode_item(row, raw: bool = False) -> dict:
+    item = dict(row)
+    item["tags"] = json_column(item["tags"], [], raw)
+    item["data"] = json_column(item["data"], {}, raw)
+    return item
+
+def build_public_item(row) -> dict:
+    row = dict(row)
+    return {
+        "slug": row["slug"],
+        "title": row["title"],
+        "type": row["type"],
+        "category": row["category"],
+        "tags": json_column(row["tags"], [], RAW_JSON_COLUMNS),
+        "data": json_column(row["data"], {}, RAW_JSON_COLUMNS),
+        "created_at": row["created_at"],
+        "updated_at": row["updated_at"],
+    }
+
+# --- Public Read Cache ---
+# /retrieve and /listpublic responses are cached per worker. Every entry is
+# tagged with the slugs it contains; list pages are also tagged with their
+# type/category filter, so a write only drops what it can change.
+public_cache = TTLCache()
+
+def row_size(rows) -> int:
+    return sum(len(v) for row in rows for v in row if isinstance(v, str)) + 64 * len(rows)
+
+def filter_tags(type: Optional[str], category: Optional[str]) -> List[str]:
+    return [f"filter:{t}:{c}" for t in (type or "*", "*") for c in (category or "*", "*")]
+
+def invalidate_public(slug: str, item: Optional[dict] = None):
+    tags = [f"slug:{slug}"]
+    if item and item["status"] == "published":
+        # The item may now show up on list pages it wasn't on before
+        tags += filter_tags(item["type"], item["category"])
+    public_cache.invalidate_tags(*tags)
+
+# --- Keyset Pagination ---
+
+def encode_cursor(key, item_id: int) -> str:
+    raw = json.dumps([key, item_id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        key, item_id = json.loads(raw)
+        if not isinstance(key, (str, int, float)) or not isinstance(item_id, int):
+            raise ValueError
+        return key, item_id
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def keyset(sql: str, params: list, cursor: Optional[str]) -> str:
+    # sql must end with its WHERE clause
+    if cursor:
+        sql += " AND (created_at, id) < (?, ?)"
+        params.extend(decode_cursor(cursor))
+    return sql + " ORDER BY created_at DESC, id DESC"
+
+def paginate(db: sqlite3.Connection, sql: str, params: list, cursor: Optional[str], limit: int):
+    # One extra row tells us if there is a next page
+    sql = keyset(sql, params, cursor) + " LIMIT ?"
+    params.append(limit + 1)
+    rows = db.execute(sql, params).fetchall()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]["created_at"], rows[-1]["id"])
+    return rows, next_cursor
+
 # --- Endpoints ---
 
 @app.get("/health")
 def health():
     return {"status": "database is healthy"}
 
-@app.get("/listall", response_model=List[Item])
+@app.get("/db-pool")
+def db_pool_stats(_ = Depends(get_admin_access)):
+    return get_pool_stats()
+
+@app.get("/metrics")
+def metrics(_ = Depends(get_admin_access)):
+    return metrics_response()
+
+@app.get("/log-stats")
+def log_stats(_ = Depends(get_admin_access)):
+    return get_log_stats()
+
+@app.get("/cache-stats")
+def cache_stats(_ = Depends(get_admin_access)):
+    return {"public": public_cache.stats(), "jwt": token_cache.stats()}
+
+@app.get("/listall", response_model=ItemPage)
 @limiter.limit("30/minute")
 def list_entries(
     request: Request,
-    db: sqlite3.Connection = Depends(get_db),
+    db: sqlite3.Connection = Depends(get_read_db),
     _ = Depends(get_admin_access),
     status: Optional[str] = None,
     type: Optional[str] = None,
@@ -105,6 +330,9 @@ def list_entries(
     owner: Optional[str] = None,
     created_from: Optional[str] = Query(None, description="YYYY-MM-DD"),
     created_to: Optional[str] = Query(None, description="YYYY-MM-DD"),
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=MAX_PAGE_SIZE),
+    stream: Optional[str] = Query(None, pattern="^(ndjson|json)$", description="Stream every matching row instead of one page"),
 ):
     sql = "SELECT * FROM items WHERE 1=1"
     params = []
@@ -126,49 +354,51 @@ def list_entries(
     if created_to:
         sql += " AND created_at <= ?"
         params.append(created_to)
-    sql += " ORDER BY created_at DESC"
 
-    rows = db.execute(sql, params).fetchall()
-    result = []
-    for row in rows:
-        item = dict(row)
-        item["tags"] = json.loads(item["tags"]) if item["tags"] else []
-        item["data"] = json.loads(item["data"]) if item["data"] else {}
-        result.append(item)
-    return result
+    if stream:
+        return stream_query(keyset(sql, params, cursor), params, partial(decode_item, raw=RAW_JSON_COLUMNS), stream)
+
+    rows, next_cursor = paginate(db, sql, params, cursor, limit)
+    return FastJSONResponse({"items": [decode_item(row, RAW_JSON_COLUMNS) for row in rows], "next_cursor": next_cursor})
 
-@app.get("/listuser", response_model=List[Item])
+@app.get("/listuser", response_model=ItemPage)
 @limiter.limit("30/minute")
 def list_user_entries(
     request: Request,
     current_user: AuthInfo = Depends(get_current_user),
-    db: sqlite3.Connection = Depends(get_db),
+    db: sqlite3.Connection = Depends(get_read_db),
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=MAX_PAGE_SIZE),
+    stream: Optional[str] = Query(None, pattern="^(ndjson|json)$", description="Stream every matching row instead of one page"),
 ):
-    rows = db.execute(
-        "SELECT * FROM items WHERE owner_id = ? ORDER BY created_at DESC",
-        (current_user.user_id,)
-    ).fetchall()
-
-    result = []
-    for row in rows:
-        item = dict(row)
-        item["tags"] = json.loads(item["tags"]) if item["tags"] else []
-        item["data"] = json.loads(item["data"]) if item["data"] else {}
-        result.append(item)
+    sql, params = "SELECT * FROM items WHERE owner_id = ?", [current_user.user_id]
+    if stream:
+        return stream_query(keyset(sql, params, cursor), params, partial(decode_item, raw=RAW_JSON_COLUMNS), stream)
 
-    return result
+    rows, next_cursor = paginate(db, sql, params, cursor, limit)
+    return FastJSONResponse({"items": [decode_item(row, RAW_JSON_COLUMNS) for row in rows], "next_cursor": next_cursor})
 
-@app.get("/listpublic", response_model=List[dict])
+@app.get("/listpublic", response_model=PublicItemPage)
 @limiter.limit("30/minute")
 def list_public_entries(
     request: Request,
-    db: sqlite3.Connection = Depends(get_db),
+    db: sqlite3.Connection = Depends(get_read_db),
     type: Optional[str] = None,
     category: Optional[str] = None,
     keyword: Optional[str] = None,
+    cursor: Optional[str] = None,
     limit: int = Query(20, ge=1, le=100),
-    offset: int = Query(0, ge=0),
 ):
+    normalized_keyword = " ".join(keyword.lower().split()) if keyword else None
+    cache_key = ("listpublic", type, category, normalized_keyword, cursor, limit)
+    generation = public_cache.generation()
+    cached = public_cache.get(cache_key)
+    if cached is not None:
+        etag, page = cached
+        if is_not_modified(request, etag):
+            return not_modified(etag)
+        return FastJSONResponse(page, headers={"ETag": etag})
+
     sql = "SELECT * FROM items WHERE status = 'published'"
     params = []
 
@@ -181,13 +411,19 @@ def list_public_entries(
         params.append(category)
 
     if keyword:
-        sql += " AND (title LIKE ? OR slug LIKE ?)"
-        params.extend([f"%{keyword}%", f"%{keyword}%"])
-
-    sql += " ORDER BY created_at DESC LIMIT ? OFFSET ?"
-    params.extend([limit, offset])
+        query = fts_query(keyword)
+        if query:
+            sql += " AND id IN (SELECT rowid FROM items_fts WHERE items_fts MATCH ?)"
+            params.append(query)
+
+    rows, next_cursor = paginate(db, sql, params, cursor, limit)
+    # The page ETag only depends on which rows are on it and their versions,
+    # so a revalidation is answered before any row JSON is decoded. Lists get
+    # no Last-Modified: removing an item doesn't move max(updated_at).
+    etag = make_etag(*(f"{row['id']}:{row['updated_at']}" for row in rows), next_cursor)
+    if is_not_modified(request, etag):
+        return not_modified(etag)
 
-    rows = db.execute(sql, params).fetchall()
     result = []
     for row in rows:
         row = dict(row)
@@ -197,34 +433,39 @@ def list_public_entries(
             "type": row["type"],
             "category": row["category"],
             "status": row["status"],
-            "tags": json.loads(row["tags"]) if row["tags"] else [],
-            "data": json.loads(row["data"]) if row["data"] else {},
+            "tags": json_column(row["tags"], [], RAW_JSON_COLUMNS),
+            "data": json_column(row["data"], {}, RAW_JSON_COLUMNS),
             "created_at": row["created_at"],
             "updated_at": row["updated_at"],
         })
-    return result
+    page = {"items": result, "next_cursor": next_cursor}
+    tags = [f"slug:{item['slug']}" for item in result] + [f"filter:{type or '*'}:{category or '*'}"]
+    public_cache.set(cache_key, (etag, page), size=row_size(rows), tags=tags, generation=generation)
+    return FastJSONResponse(page, headers={"ETag": etag})
 
 
 @app.get("/retrieve/{slug}", response_model=dict)
 @limiter.limit("30/minute")
-def retrieve_entry(request: Request, slug: str, db: sqlite3.Connection = Depends(get_db)):
-    row = db.execute(
-        "SELECT * FROM items WHERE slug = ? AND status = 'published'", (slug,)
-    ).fetchone()
-    if not row:
-        raise HTTPException(status_code=404, detail="Item not found")
-
-    row = dict(row)
-    return {
-        "slug": row["slug"],
-        "title": row["title"],
-        "type": row["type"],
-        "category": row["category"],
-        "tags": json.loads(row["tags"]) if row["tags"] else [],
-        "data": json.loads(row["data"]) if row["data"] else {},
-        "created_at": row["created_at"],
-        "updated_at": row["updated_at"],
-    }
+def retrieve_entry(request: Request, slug: str, db: sqlite3.Connection = Depends(get_read_db)):
+    generation = public_cache.generation()
+    cached = public_cache.get(("retrieve", slug))
+    if cached is None:
+        row = db.execute(
+            "SELECT * FROM items WHERE slug = ? AND status = 'published'", (slug,)
+        ).fetchone()
+        if not row:
+            raise HTTPException(status_code=404, detail="Item not found")
+        etag = make_etag(row["id"], row["updated_at"])
+        last_modified = parse_db_timestamp(row["updated_at"])
+        if is_not_modified(request, etag, last_modified):
+            return not_modified(etag, last_modified)
+        cached = (etag, last_modified, build_public_item(row))
+        public_cache.set(("retrieve", slug), cached, size=row_size([row]), tags=[f"slug:{slug}"], generation=generation)
+
+    etag, last_modified, result = cached
+    if is_not_modified(request, etag, last_modified):
+        return not_modified(etag, last_modified)
+    return FastJSONResponse(result, headers={"ETag": etag, "Last-Modified": http_date(last_modified)})
 
 
 @app.post("/create", response_model=Item, status_code=201)
@@ -233,13 +474,14 @@ def create_entry(
     request: Request,
     item: ItemCreate,
     current_user: AuthInfo = Depends(get_current_user),
-    db: sqlite3.Connection = Depends(get_db)
 ):
-    logger.info(f"User '{current_user.user_id}' creating entry '{item.slug}'")
-    try:
-        cursor = safe_write(db, """
+    logger.info("User '%s' creating entry '%s'", current_user.user_id, item.slug)
+
+    def insert_item(db: sqlite3.Connection):
+        return db.execute("""
             INSERT INTO items (owner_id, slug, title, type, category, tags, status, data)
             VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            RETURNING *
         """, (
             current_user.user_id,
             item.slug,
@@ -249,15 +491,17 @@ def create_entry(
             json.dumps(item.tags),
             item.status,
             json.dumps(item.data),
-        ))
-        db.commit()
+        )).fetchone()
+
+    try:
+        new_item = write(insert_item)
     except sqlite3.IntegrityError:
          raise HTTPException(status_code=409, detail=f"Item with slug '{item.slug}' already exists.")
 
-    new_item = db.execute("SELECT * FROM items WHERE id = ?", (cursor.lastrowid,)).fetchone()
     item_dict = dict(new_item)
-    item_dict["tags"] = json.loads(item_dict["tags"]) if item_dict["tags"] else []
-    item_dict["data"] = json.loads(item_dict["data"]) if item_dict["data"] else {}
+    item_dict["tags"] = json_loads(item_dict["tags"]) if item_dict["tags"] else []
+    item_dict["data"] = json_loads(item_dict["data"]) if item_dict["data"] else {}
+    invalidate_public(item.slug, item_dict)
     return item_dict
 
 @app.put("/update/{slug}", response_model=Item)
@@ -267,32 +511,34 @@ def update_entry(
     slug: str,
     item_update: ItemUpdate,
     current_user: AuthInfo = Depends(get_current_user),
-    db: sqlite3.Connection = Depends(get_db)
 ):
-    existing_item = db.execute("SELECT owner_id FROM items WHERE slug = ?", (slug,)).fetchone()
-    if not existing_item:
-        raise HTTPException(status_code=404, detail="Item not found")
-    if existing_item["owner_id"] != current_user.user_id:
-        raise HTTPException(status_code=403, detail="Not authorized to update this item")
-
-    safe_write(db, """
-        UPDATE items
-        SET title = ?, type = ?, category = ?, tags = ?, status = ?, data = ?, updated_at = CURRENT_TIMESTAMP
-        WHERE slug = ?
-    """, (
-        item_update.title,
-        item_update.type,
-        item_update.category,
-        json.dumps(item_update.tags),
-        item_update.status,
-        json.dumps(item_update.data),
-        slug
-    ))
-    db.commit()
-    updated_item = db.execute("SELECT * FROM items WHERE slug = ?", (slug,)).fetchone()
+    def update_item(db: sqlite3.Connection):
+        existing_item = db.execute("SELECT owner_id FROM items WHERE slug = ?", (slug,)).fetchone()
+        if not existing_item:
+            raise HTTPException(status_code=404, detail="Item not found")
+        if existing_item["owner_id"] != current_user.user_id:
+            raise HTTPException(status_code=403, detail="Not authorized to update this item")
+
+        return db.execute("""
+            UPDATE items
+            SET title = ?, type = ?, category = ?, tags = ?, status = ?, data = ?, updated_at = strftime('%Y-%m-%d %H:%M:%f', 'now')
+            WHERE slug = ?
+            RETURNING *
+        """, (
+            item_update.title,
+            item_update.type,
+            item_update.category,
+            json.dumps(item_update.tags),
+            item_update.status,
+            json.dumps(item_update.data),
+            slug
+        )).fetchone()
+
+    updated_item = write(update_item)
     item_dict = dict(updated_item)
-    item_dict["tags"] = json.loads(item_dict["tags"]) if item_dict["tags"] else []
-    item_dict["data"] = json.loads(item_dict["data"]) if item_dict["data"] else {}
+    item_dict["tags"] = json_loads(item_dict["tags"]) if item_dict["tags"] else []
+    item_dict["data"] = json_loads(item_dict["data"]) if item_dict["data"] else {}
+    invalidate_public(slug, item_dict)
     return item_dict
 
 @app.delete("/delete/{slug}", status_code=200)
@@ -301,29 +547,188 @@ def delete_entry(
     request: Request,
     slug: str,
     current_user: AuthInfo = Depends(get_current_user),
-    db: sqlite3.Connection = Depends(get_db)
 ):
-    existing_item = db.execute("SELECT owner_id FROM items WHERE slug = ?", (slug,)).fetchone()
-    if not existing_item:
-        raise HTTPException(status_code=404, detail="Item not found")
-    if existing_item["owner_id"] != current_user.user_id:
-        raise HTTPException(status_code=403, detail="Not authorized to delete this item")
-
-    safe_write(db, "DELETE FROM items WHERE slug = ?", (slug,))
-    db.commit()
-    logger.info(f"User '{current_user.user_id}' deleted item with slug '{slug}'")
+    def delete_item(db: sqlite3.Connection):
+        existing_item = db.execute("SELECT owner_id FROM items WHERE slug = ?", (slug,)).fetchone()
+        if not existing_item:
+            raise HTTPException(status_code=404, detail="Item not found")
+        if existing_item["owner_id"] != current_user.user_id:
+            raise HTTPException(status_code=403, detail="Not authorized to delete this item")
+        db.execute("DELETE FROM items WHERE slug = ?", (slug,))
+
+    write(delete_item)
+    invalidate_public(slug)
+    logger.info("User '%s' deleted item with slug '%s'", current_user.user_id, slug)
     return {"message": f"Item '{slug}' deleted successfully"}
 
-@app.get("/search", response_model=List[dict])
+# --- Bulk Operations ---
+
+async def read_bulk_operations(request: Request) -> List[Union[BulkOperation, str]]:
+    # Accepts a JSON array, or NDJSON (one operation per line) parsed as it streams in.
+    # Entries that fail validation are kept as their error message.
+    raw_ops = []
+    if "ndjson" in request.headers.get("content-type", ""):
+        buffer = b""
+        async for chunk in request.stream():
+            buffer += chunk
+            *lines, buffer = buffer.split(b"\n")
+            raw_ops.extend(line for line in lines if line.strip())
+            if len(raw_ops) > BULK_MAX_OPS:
+                raise HTTPException(status_code=413, detail=f"A bulk request can hold at most {BULK_MAX_OPS} operations.")
+        if buffer.strip():
+            raw_ops.append(buffer)
+    else:
+        try:
+            raw_ops = await request.json()
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Body must be a JSON array or NDJSON.")
+        if not isinstance(raw_ops, list):
+            raise HTTPException(status_code=400, detail="Body must be a JSON array or NDJSON.")
+    if len(raw_ops) > BULK_MAX_OPS:
+        raise HTTPException(status_code=413, detail=f"A bulk request can hold at most {BULK_MAX_OPS} operations.")
+
+    ops = []
+    for raw in raw_ops:
+        try:
+            ops.append(BulkOperation.model_validate_json(raw) if isinstance(raw, bytes) else BulkOperation.model_validate(raw))
+        except ValidationError as e:
+            ops.append("; ".join(f"{'.'.join(str(l) for l in err['loc'])}: {err['msg']}" for err in e.errors()))
+    return ops
+
+def apply_bulk_operations(db: sqlite3.Connection, owner_id: str, ops: List[Union[BulkOperation, str]]) -> dict:
+    results = [None] * len(ops)
+    valid = []
+    seen = set()
+    for index, op in enumerate(ops):
+        if isinstance(op, str):
+            results[index] = {"index": index, "status": 422, "detail": op}
+        elif op.slug in seen:
+            results[index] = {"index": index, "op": op.op, "slug": op.slug, "status": 409, "detail": "Slug appears more than once in this batch."}
+        else:
+            seen.add(op.slug)
+            valid.append((index, op))
+
+    # Runs as one write operation (one transaction), so the existence checks below still hold at commit
+    creates, updates, deletes = [], [], []
+    returned = {}
+    existing = {}
+    for start in range(0, len(valid), BULK_CHUNK_SIZE):
+        slugs = [op.slug for _, op in valid[start:start + BULK_CHUNK_SIZE]]
+        placeholders = ", ".join("?" * len(slugs))
+        for row in db.execute(f"SELECT slug, owner_id FROM items WHERE slug IN ({placeholders})", slugs):
+            existing[row["slug"]] = row["owner_id"]
+
+    for index, op in valid:
+        owner = existing.get(op.slug)
+        if op.op == "create":
+            if owner is not None:
+                results[index] = {"index": index, "op": op.op, "slug": op.slug, "status": 409, "detail": f"Item with slug '{op.slug}' already exists."}
+            else:
+                creates.append((index, op))
+        elif owner is None:
+            results[index] = {"index": index, "op": op.op, "slug": op.slug, "status": 404, "detail": "Item not found"}
+        elif owner != owner_id:
+            results[index] = {"index": index, "op": op.op, "slug": op.slug, "status": 403, "detail": f"Not authorized to {op.op} this item"}
+        elif op.op == "update":
+            updates.append((index, op))
+        else:
+            deletes.append((index, op))
+
+    for start in range(0, len(creates), BULK_CHUNK_SIZE):
+        chunk = creates[start:start + BULK_CHUNK_SIZE]
+        sql = (
+            "INSERT INTO items (owner_id, slug, title, type, category, tags, status, data) VALUES "
+            + ", ".join(["(?, ?, ?, ?, ?, ?, ?, ?)"] * len(chunk))
+            + " RETURNING *"
+        )
+        params = []
+        for _, op in chunk:
+            params.extend([owner_id, op.slug, op.title, op.type, op.category, json.dumps(op.tags), op.status, json.dumps(op.data)])
+        for row in db.execute(sql, params).fetchall():
+            returned[row["slug"]] = row
+
+    for start in range(0, len(updates), BULK_CHUNK_SIZE):
+        chunk = updates[start:start + BULK_CHUNK_SIZE]
+        sql = (
+            "UPDATE items SET title = v.column2, type = v.column3, category = v.column4, tags = v.column5, "
+            "status = v.column6, data = v.column7, updated_at = strftime('%Y-%m-%d %H:%M:%f', 'now') "
+            "FROM (VALUES " + ", ".join(["(?, ?, ?, ?, ?, ?, ?)"] * len(chunk)) + ") AS v "
+            "WHERE items.slug = v.column1 RETURNING *"
+        )
+        params = []
+        for _, op in chunk:
+            params.extend([op.slug, op.title, op.type, op.category, json.dumps(op.tags), op.status, json.dumps(op.data)])
+        for row in db.execute(sql, params).fetchall():
+            returned[row["slug"]] = row
+
+    if deletes:
+        db.executemany("DELETE FROM items WHERE slug = ?", [(op.slug,) for _, op in deletes])
+
+    for index, op in creates + updates:
+        item = decode_item(returned[op.slug])
+        results[index] = {"index": index, "op": op.op, "slug": op.slug, "status": 201 if op.op == "create" else 200, "item": item}
+    for index, op in deletes:
+        results[index] = {"index": index, "op": op.op, "slug": op.slug, "status": 200, "detail": "deleted"}
+
+    return {
+        "results": results,
+        "created": len(creates),
+        "updated": len(updates),
+        "deleted": len(deletes),
+        "failed": len(ops) - len(creates) - len(updates) - len(deletes),
+    }
+
+@app.post("/bulk", response_model=BulkResponse)
+@limiter.limit("5/minute")
+async def bulk_entries(
+    request: Request,
+    current_user: AuthInfo = Depends(get_current_user),
+):
+    ops = await read_bulk_operations(request)
+    response = await write_async(apply_bulk_operations, current_user.user_id, ops)
+    for result in response["results"]:
+        if result["status"] in (200, 201):
+            invalidate_public(result["slug"], result.get("item"))
+    logger.info(
+        "User '%s' bulk request: %s created, %s updated, %s deleted, %s failed",
+        current_user.user_id, response["created"], response["updated"], response["deleted"], response["failed"],
+    )
+    return response
+
+@app.get("/search", response_model=PublicItemPage)
 @limiter.limit("30/minute")
 def search_entries(
     request: Request,
-    db: sqlite3.Connection = Depends(get_db),
+    db: sqlite3.Connection = Depends(get_read_db),
     keyword: str = Query(..., description="Search keyword"),
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=MAX_PAGE_SIZE),
 ):
-    sql = "SELECT * FROM items WHERE status = 'published' AND (title LIKE ? OR slug LIKE ?) ORDER BY created_at DESC"
-    param = f"%{keyword}%"
-    rows = db.execute(sql, (param, param)).fetchall()
+    query = fts_query(keyword)
+    if not query:
+        return FastJSONResponse({"items": [], "next_cursor": None})
+
+    # Ranked by bm25 (title and slug weigh most), paged on (score, id)
+    sql = """
+        SELECT * FROM (
+            SELECT items.*,
+                   bm25(items_fts, 10.0, 5.0, 3.0, 1.0) AS score,
+                   snippet(items_fts, -1, char(2), char(3), '…', 12) AS snippet
+            FROM items_fts JOIN items ON items.id = items_fts.rowid
+            WHERE items_fts MATCH ? AND items.status = 'published'
+        ) WHERE 1=1
+    """
+    params = [query]
+    if cursor:
+        sql += " AND (score, id) > (?, ?)"
+        params.extend(decode_cursor(cursor))
+    sql += " ORDER BY score, id LIMIT ?"
+    params.append(limit + 1)
+    rows = db.execute(sql, params).fetchall()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]["score"], rows[-1]["id"])
 
     result = []
     for row in rows:
@@ -333,10 +738,21 @@ def search_entries(
             "title": row["title"],
             "type": row["type"],
             "category": row["category"],
-            "tags": json.loads(row["tags"]) if row["tags"] else [],
-            "data": json.loads(row["data"]) if row["data"] else {},
+            "tags": json_column(row["tags"], [], RAW_JSON_COLUMNS),
+            "data": json_column(row["data"], {}, RAW_JSON_COLUMNS),
             "created_at": row["created_at"],
             "updated_at": row["updated_at"],
+            "snippet": highlight_snippet(row["snippet"]),
         })
-    return result
-
+    return FastJSONResponse({"items": result, "next_cursor": next_cursor})
+
+if __name__ == "__main__":
+    # Maintenance commands, run from the database directory: python main.py rebuild-fts
+    if sys.argv[1:] == ["rebuild-fts"]:
+        with sqlite3.connect(DB_PATH, timeout=600) as db:
+            db.execute("BEGIN IMMEDIATE;")
+            count = rebuild_fts(db)
+        logger.info("Full-text index rebuilt with %s items.", count)
+    else:
+        print("Usage: python main.py rebuild-fts")
+        sys.exit(1)
@@ -0,0 +1,70 @@
+"""Checks the /download headers for both delivery modes without nginx.
+
+Runs the storage app in-process against a throwaway directory, uploads a file
+and resolves the X-Accel-Redirect target the way the nginx internal location
+would (prefix -> alias of the upload dir).
+
+    python check_accel_headers.py
+"""
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+PREFIX = "/_protected_files/"
+SERVICE_DIR = Path(__file__).resolve().parent
+
+workdir = Path(tempfile.mkdtemp(prefix="storage-accel-"))
+(workdir / "logs" / "storage").mkdir(parents=True)
+(workdir / "storage").mkdir()
+os.chdir(workdir / "storage")
+os.environ.update({"DB_PATH": "storage.db", "JWT_SECRET": "accel-check", "DOWNLOAD_ACCEL_PREFIX": PREFIX})
+sys.path.insert(0, str(SERVICE_DIR))
+
+from fastapi.testclient import TestClient
+import helpers
+import main
+
+failures = 0
+
+def check(name: str, ok: bool, detail=""):
+    global failures
+    failures += not ok
+    print(f"{'PASS' if ok else 'FAIL'} {name}{f' ({detail})' if detail and not ok else ''}")
+
+client = TestClient(main.app)
+token = helpers.create_jwt({"sub": "accel-user", "email": "accel@example.com"})
+payload = os.urandom(256 * 1024)
+upload = client.post(
+    "/upload",
+    files={"file": ("clip one.mp4", payload, "video/mp4")},
+    headers={"Authorization": f"Bearer {token}"},
+)
+check("upload", upload.status_code == 200, upload.text)
+file_id = upload.json()["id"]
+
+# --- X-Accel-Redirect mode ---
+response = client.get(f"/download/{file_id}", headers={"Range": "bytes=0-99"})
+target = response.headers.get("x-accel-redirect", "")
+check("accel: status 200, range left to nginx", response.status_code == 200, response.status_code)
+check("accel: empty body", response.content == b"", len(response.content))
+check("accel: redirect under internal prefix", target.startswith(PREFIX), target)
+resolved = main.UPLOAD_DIR.resolve() / target[len(PREFIX):]
+check("accel: redirect resolves to the uploaded bytes", resolved.is_file() and resolved.read_bytes() == payload, resolved)
+check("accel: content type", response.headers.get("content-type") == "video/mp4", response.headers.get("content-type"))
+check("accel: cache control", response.headers.get("cache-control") == main.DOWNLOAD_CACHE_CONTROL, response.headers.get("cache-control"))
+check("accel: missing file is 404", client.get("/download/nope").status_code == 404)
+
+# --- In-process fallback ---
+main.DOWNLOAD_ACCEL_PREFIX = ""
+response = client.get(f"/download/{file_id}")
+check("fallback: full body streamed", response.status_code == 200 and response.content == payload, response.status_code)
+check("fallback: no X-Accel-Redirect", "x-accel-redirect" not in response.headers)
+check("fallback: strong ETag", response.headers.get("etag", "").startswith('"'), response.headers.get("etag"))
+ranged = client.get(f"/download/{file_id}", headers={"Range": "bytes=0-99"})
+check("fallback: range served in-process", ranged.status_code == 206 and ranged.content == payload[:100], ranged.status_code)
+cached = client.get(f"/download/{file_id}", headers={"If-None-Match": response.headers.get("etag", "")})
+check("fallback: revalidation", cached.status_code == 304, cached.status_code)
+
+print(f"\n{failures} failed" if failures else "\nall checks passed")
+sys.exit(1 if failures else 0)
@@ -1,20 +1,29 @@
 import os
+import sys
+import time
 import aiofiles
+import hashlib
+import mimetypes
 import secrets
 import sqlite3
+import stat
+from contextlib import contextmanager
 from pathlib import Path
+from urllib.parse import quote
 from dotenv import load_dotenv
 
-from fastapi import FastAPI, Depends, HTTPException, UploadFile, File, Request
+from fastapi import FastAPI, Depends, HTTPException, UploadFile, File, Request, Query, Header
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
-from pydantic import BaseModel
-from typing import List
+from fastapi.responses import Response, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
+from starlette.requests import ClientDisconnect
+from pydantic import BaseModel, Field
+from typing import Dict, List, Optional
 
-from helpers import get_current_user, setup_logger, limiter, AuthInfo, get_admin_access, get_db, safe_write
+from helpers import get_current_user, setup_logger, limiter, AuthInfo, get_admin_access, get_async_read_db, AsyncConnection, write, write_async, pooled_connection, PeriodicJob, get_pool_stats, token_cache, stream_query, FastJSONResponse, make_etag, parse_db_timestamp, http_date, is_not_modified, not_modified, get_log_stats, MetricsMiddleware, metrics_response, ProfilingMiddleware, Counter
 
 load_dotenv()
-app = FastAPI(root_path="/v1/storage")
+app = FastAPI(root_path="/v1/storage", default_response_class=FastJSONResponse)
 
 # Add CORS middleware
 app.add_middleware(
@@ -24,116 +33,858 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(ProfilingMiddleware, service="storage")
+app.add_middleware(MetricsMiddleware)
 
 app.state.limiter = limiter
 logger = setup_logger("storage", f"../logs/storage/output.log")
 UPLOAD_DIR = Path("files")
 UPLOAD_DIR.mkdir(exist_ok=True)
+# Content-addressed store: blobs/<aa>/<bb>/<sha256>, shared by every file row with the same bytes
+BLOB_DIR = UPLOAD_DIR / "blobs"
+INCOMING_DIR = UPLOAD_DIR / "incoming"
+INCOMING_DIR.mkdir(exist_ok=True)
 DB_PATH = Path("storage.db")
+DOWNLOAD_CACHE_CONTROL = os.getenv("DOWNLOAD_CACHE_CONTROL", "public, max-age=3600")
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+MAX_RANGES = 32
+# Optional nginx offload. With a prefix set, /download only does the lookup and answers with
+# X-Accel-Redirect; nginx then serves the file (ranges, conditional requests) from an internal location:
+#   location /_protected_files/ { internal; alias /var/www/<project>/storage/files/; }
+DOWNLOAD_ACCEL_PREFIX = os.getenv("DOWNLOAD_ACCEL_PREFIX", "")
+CRLF = "\r\n"
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(5 * 1024 ** 3)))
+STORAGE_QUOTA_BYTES = int(os.getenv("STORAGE_QUOTA_BYTES", "0"))  # default per owner, 0 = unlimited
+RAW_UPLOAD_BUFFER_SIZE = 1024 * 1024
+UPLOAD_SESSION_TTL_HOURS = int(os.getenv("UPLOAD_SESSION_TTL_HOURS", "24"))
+UPLOAD_SESSION_GC_INTERVAL = float(os.getenv("UPLOAD_SESSION_GC_INTERVAL", "600"))
+UPLOAD_CHUNK_LEASE = float(os.getenv("UPLOAD_CHUNK_LEASE", "300"))  # seconds one PATCH may keep writing
+
+STORAGE_BYTES_IN = Counter("storage_bytes_in_total", "Upload bytes received.", ("method",))
+STORAGE_BYTES_OUT = Counter("storage_bytes_out_total", "Download bytes sent by this process (not through X-Accel-Redirect).", ("status",))
+STORAGE_DOWNLOADS = Counter("storage_downloads_total", "Download responses by delivery mode.", ("mode",))
+
+# --- USAGE ACCOUNTING ---
+# storage_usage holds one row per owner, kept in step with files by triggers, so
+# every write path (uploads, deletes, backfill) updates it in the same transaction.
+
+def _create_usage_triggers(db: sqlite3.Connection):
+    add_usage = """
+        INSERT INTO storage_usage (owner_id, file_count, used_bytes) VALUES (new.owner_id, 1, COALESCE(new.size_bytes, 0))
+        ON CONFLICT(owner_id) DO UPDATE SET file_count = file_count + 1, used_bytes = used_bytes + excluded.used_bytes;
+    """
+    remove_usage = """
+        UPDATE storage_usage SET file_count = file_count - 1, used_bytes = used_bytes - COALESCE(old.size_bytes, 0)
+        WHERE owner_id = old.owner_id;
+    """
+    db.execute(f"CREATE TRIGGER IF NOT EXISTS files_usage_ai AFTER INSERT ON files BEGIN {add_usage} END;")
+    db.execute(f"CREATE TRIGGER IF NOT EXISTS files_usage_ad AFTER DELETE ON files BEGIN {remove_usage} END;")
+    db.execute(f"CREATE TRIGGER IF NOT EXISTS files_usage_au AFTER UPDATE OF owner_id, size_bytes ON files BEGIN {remove_usage} {add_usage} END;")
+
+def rebuild_usage(db: sqlite3.Connection):
+    # recount from files; per-owner quotas are kept
+    db.execute("UPDATE storage_usage SET file_count = 0, used_bytes = 0")
+    db.execute("""
+    INSERT INTO storage_usage (owner_id, file_count, used_bytes)
+    SELECT owner_id, COUNT(*), COALESCE(SUM(size_bytes), 0) FROM files GROUP BY owner_id
+    ON CONFLICT(owner_id) DO UPDATE SET file_count = excluded.file_count, used_bytes = excluded.used_bytes
+    """)
+
+def backfill_usage(db: sqlite3.Connection):
+    # files stored before sizes were recorded: stat them in the files/ tree
+    rows = db.execute("SELECT id, disk_path FROM files WHERE size_bytes IS NULL").fetchall()
+    sizes, missing = [], 0
+    for file_id, disk_path in rows:
+        try:
+            sizes.append((os.stat(disk_path).st_size, file_id))
+        except FileNotFoundError:
+            missing += 1
+            logger.warning("Backfill: file ID %s is missing on disk at %s", file_id, disk_path)
+    db.executemany("UPDATE files SET size_bytes = ? WHERE id = ?", sizes)
+    rebuild_usage(db)
+    return len(sizes), missing
+
+@contextmanager
+def schema_lock(db: sqlite3.Connection):
+    # Check-then-change migrations run under one write lock, so workers starting
+    # together never both see a change as missing and apply it twice.
+    db.commit()
+    db.execute("BEGIN IMMEDIATE;")
+    try:
+        yield
+        db.commit()
+    except BaseException:
+        db.rollback()
+        raise
 
 def init_db():
-    with sqlite3.connect(DB_PATH) as db:
+    # Generous timeout: another worker may hold the write lock while migrating files
+    with sqlite3.connect(DB_PATH, timeout=600) as db:
         db.execute("PRAGMA journal_mode=WAL;")
         db.execute("""
         CREATE TABLE IF NOT EXISTS files (
             id TEXT PRIMARY KEY,
             owner_id TEXT NOT NULL,
             original_name TEXT NOT NULL,
-            disk_path TEXT NOT NULL UNIQUE,
+            disk_path TEXT NOT NULL,
             content_type TEXT,
+            size_bytes INTEGER,
+            checksum TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        """)
+        db.execute("""
+        CREATE TABLE IF NOT EXISTS blobs (
+            checksum TEXT PRIMARY KEY,
+            disk_path TEXT NOT NULL,
+            size_bytes INTEGER NOT NULL,
+            refcount INTEGER NOT NULL,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         );
         """)
+        # files uploaded before size/checksum were recorded keep NULLs and fall back to stat-based validators
+        with schema_lock(db):
+            columns = {row[1] for row in db.execute("PRAGMA table_info(files)")}
+            for column, ddl in (("size_bytes", "INTEGER"), ("checksum", "TEXT")):
+                if column not in columns:
+                    db.execute(f"ALTER TABLE files ADD COLUMN {column} {ddl}")
+        # disk_path used to be UNIQUE; deduplicated files share their blob path, so rebuild without it
+        with schema_lock(db):
+            files_sql = db.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'files'").fetchone()[0]
+            if "UNIQUE" in files_sql:
+                db.execute("ALTER TABLE files RENAME TO files_old")
+                db.execute("""
+                CREATE TABLE files (
+                    id TEXT PRIMARY KEY,
+                    owner_id TEXT NOT NULL,
+                    original_name TEXT NOT NULL,
+                    disk_path TEXT NOT NULL,
+                    content_type TEXT,
+                    size_bytes INTEGER,
+                    checksum TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                );
+                """)
+                db.execute("""
+                INSERT INTO files (id, owner_id, original_name, disk_path, content_type, size_bytes, checksum, created_at)
+                SELECT id, owner_id, original_name, disk_path, content_type, size_bytes, checksum, created_at FROM files_old
+                """)
+                db.execute("DROP TABLE files_old")
+                logger.info("Migrated files table: dropped UNIQUE on disk_path.")
+        usage_exists = db.execute("SELECT 1 FROM sqlite_master WHERE name = 'storage_usage'").fetchone()
+        db.execute("""
+        CREATE TABLE IF NOT EXISTS storage_usage (
+            owner_id TEXT PRIMARY KEY,
+            file_count INTEGER NOT NULL DEFAULT 0,
+            used_bytes INTEGER NOT NULL DEFAULT 0,
+            quota_bytes INTEGER
+        );
+        """)
+        _create_usage_triggers(db)
+        if not usage_exists:
+            rebuild_usage(db)
+            if db.execute("SELECT 1 FROM files WHERE size_bytes IS NULL LIMIT 1").fetchone():
+                logger.info("Storage usage table created; run 'python main.py backfill-usage' to size older files.")
+        db.execute("""
+        CREATE TABLE IF NOT EXISTS upload_sessions (
+            id TEXT PRIMARY KEY,
+            owner_id TEXT NOT NULL,
+            original_name TEXT NOT NULL,
+            content_type TEXT,
+            size_bytes INTEGER NOT NULL,
+            received_bytes INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        """)
+        # claim_token/claimed_until: the PATCH currently writing at received_bytes, on any worker
+        with schema_lock(db):
+            columns = {row[1] for row in db.execute("PRAGMA table_info(upload_sessions)")}
+            for column, ddl in (("claim_token", "TEXT"), ("claimed_until", "REAL")):
+                if column not in columns:
+                    db.execute(f"ALTER TABLE upload_sessions ADD COLUMN {column} {ddl}")
         db.execute("CREATE INDEX IF NOT EXISTS idx_files_owner_id ON files(owner_id);")
+        db.execute("CREATE INDEX IF NOT EXISTS idx_files_disk_path ON files(disk_path);")
+        db.execute("CREATE INDEX IF NOT EXISTS idx_upload_sessions_updated ON upload_sessions(updated_at);")
         logger.info("Storage database initialized.")
 init_db()
 
-def sanitize_filename(filename: str) -> str:
-    return "".join(c if c.isalnum() or c in "._-" else "_" for c in filename)
+# --- BLOB STORE ---
+# These functions run inside write operations: the single writer serialises
+# the blob moves/unlinks with the refcount changes, so an upload can never
+# revive a blob that a concurrent delete is about to unlink. Unlinking happens
+# in its own operation, after the delete has committed, so a rolled back
+# delete never leaves a files row pointing at missing bytes.
+
+def add_blob_reference(db: sqlite3.Connection, temp_path: Path, checksum: str, size_bytes: int) -> Path:
+    blob = db.execute(
+        "UPDATE blobs SET refcount = refcount + 1 WHERE checksum = ? RETURNING disk_path", (checksum,)
+    ).fetchone()
+    blob_path = Path(blob["disk_path"]) if blob else BLOB_DIR / checksum[:2] / checksum[2:4] / checksum
+    if blob and blob_path.is_file():
+        return blob_path
+
+    # Hard-linked rather than moved: if the transaction rolls back, temp_path is
+    # still there for a retry (a finalized upload session keeps its bytes).
+    # Callers remove temp_path once the write has committed.
+    blob_path.parent.mkdir(parents=True, exist_ok=True)
+    staged = blob_path.with_name(f"{blob_path.name}.{secrets.token_hex(4)}")
+    os.link(temp_path, staged)
+    os.replace(staged, blob_path)
+    if not blob:
+        db.execute(
+            "INSERT INTO blobs (checksum, disk_path, size_bytes, refcount) VALUES (?, ?, ?, 1)",
+            (checksum, str(blob_path), size_bytes)
+        )
+    return blob_path
+
+def read_one(query: str, params=()):
+    # short-lived reader for long-running upload requests, which must not hold a pooled connection while streaming
+    with pooled_connection(readonly=True) as db:
+        return db.execute(query, params).fetchone()
+
+def get_usage(db: sqlite3.Connection, owner_id: str) -> dict:
+    row = db.execute("SELECT file_count, used_bytes, quota_bytes FROM storage_usage WHERE owner_id = ?", (owner_id,)).fetchone()
+    file_count, used, quota = row if row else (0, 0, None)
+    quota = STORAGE_QUOTA_BYTES if quota is None else quota
+    return {
+        "owner_id": owner_id,
+        "file_count": file_count,
+        "used_bytes": used,
+        "quota_bytes": quota or None,
+        "available_bytes": max(0, quota - used) if quota else None,
+    }
+
+def upload_limit(usage: dict) -> int:
+    # what one more upload may add: the per-file cap or the rest of the owner's quota
+    if usage["available_bytes"] is not None:
+        return min(MAX_UPLOAD_BYTES, usage["available_bytes"])
+    return MAX_UPLOAD_BYTES
+
+def get_usage_readonly(owner_id: str) -> dict:
+    with pooled_connection(readonly=True) as db:
+        return get_usage(db, owner_id)
+
+async def current_upload_limit(owner_id: str) -> int:
+    return upload_limit(await run_in_threadpool(get_usage_readonly, owner_id))
+
+def upload_too_large(limit: int) -> HTTPException:
+    return HTTPException(status_code=413, detail=f"Upload exceeds the size limit or storage quota ({limit} bytes available)")
+
+def store_file(db: sqlite3.Connection, file_id: str, owner_id: str, original_name: str, content_type: str,
+               temp_path: Path, checksum: str, size_bytes: int):
+    # quota re-checked here, inside the single writer, so parallel uploads cannot overshoot it together
+    limit = upload_limit(get_usage(db, owner_id))
+    if size_bytes > limit:
+        raise upload_too_large(limit)
+    blob_path = add_blob_reference(db, temp_path, checksum, size_bytes)
+    db.execute(
+        "INSERT INTO files (id, owner_id, original_name, disk_path, content_type, size_bytes, checksum) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        (file_id, owner_id, original_name, str(blob_path), content_type, size_bytes, checksum)
+    )
+
+def remove_blob_reference(db: sqlite3.Connection, file_record) -> Optional[Path]:
+    # Returns the path to unlink once this transaction has committed, if any
+    blob = db.execute(
+        "UPDATE blobs SET refcount = refcount - 1 WHERE checksum = ? AND disk_path = ? RETURNING refcount",
+        (file_record["checksum"], file_record["disk_path"])
+    ).fetchone()
+    if blob and blob["refcount"] > 0:
+        return None
+    if blob:
+        db.execute("DELETE FROM blobs WHERE checksum = ?", (file_record["checksum"],))
+    # last reference, or a file stored before deduplication
+    return Path(file_record["disk_path"])
+
+def unlink_unreferenced_blob(db: sqlite3.Connection, file_path: Path):
+    # Changes no rows, so a rolled back batch cannot undo anything here; an
+    # upload committed in between may already have stored the same bytes again.
+    if db.execute("SELECT 1 FROM files WHERE disk_path = ? LIMIT 1", (str(file_path),)).fetchone():
+        return
+    try:
+        file_path.unlink()
+        logger.info("File physically removed: %s", file_path)
+    except FileNotFoundError:
+        logger.warning("File metadata found but missing on disk: %s", file_path)
+    except OSError as e:
+        logger.error("Could not remove %s, left as orphan: %s", file_path, e)
+
+# --- RANGE REQUESTS (RFC 7233) ---
+
+def parse_range_header(value: str, size: int):
+    # None: ignore the header and send the whole file (unknown unit or bad syntax)
+    # []: syntactically valid but nothing satisfiable -> 416
+    # otherwise sorted, coalesced (start, end) pairs, end inclusive
+    units, _, spec = value.partition("=")
+    if units.strip().lower() != "bytes":
+        return None
+    ranges, specs = [], 0
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        specs += 1
+        first, sep, last = (x.strip() for x in part.partition("-"))
+        if not sep or (first and not first.isdigit()) or (last and not last.isdigit()) or not (first or last):
+            return None
+        if first:
+            start, end = int(first), int(last) if last else None
+            if end is not None and end < start:
+                return None
+            if start < size:
+                ranges.append((start, size - 1 if end is None else min(end, size - 1)))
+        elif int(last) > 0 and size > 0:
+            ranges.append((max(0, size - int(last)), size - 1))
+    if not specs or specs > MAX_RANGES:
+        return None
+
+    merged = []
+    for start, end in sorted(ranges):
+        # overlapping or nearly adjacent ranges are cheaper to send as one part
+        if merged and start <= merged[-1][1] + 80:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+async def read_ranges(path: Path, ranges, parts=None, status: int = 200):
+    async with aiofiles.open(path, "rb") as f:
+        for i, (start, end) in enumerate(ranges):
+            if parts:
+                yield parts[i]
+            await f.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = await f.read(min(DOWNLOAD_CHUNK_SIZE, remaining))
+                if not chunk:
+                    return
+                remaining -= len(chunk)
+                STORAGE_BYTES_OUT.inc(len(chunk), status)
+                yield chunk
+        if parts:
+            yield parts[-1]
+
+def range_response(path: Path, size: int, media_type: str, headers: dict, ranges) -> Response:
+    headers["Accept-Ranges"] = "bytes"
+    if ranges is None:
+        headers["Content-Length"] = str(size)
+        return StreamingResponse(read_ranges(path, [(0, size - 1)] if size else []), media_type=media_type, headers=headers)
+    if not ranges:
+        headers["Content-Range"] = f"bytes */{size}"
+        return Response(status_code=416, headers=headers)
+    if len(ranges) == 1:
+        start, end = ranges[0]
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+        headers["Content-Length"] = str(end - start + 1)
+        return StreamingResponse(read_ranges(path, ranges, status=206), status_code=206, media_type=media_type, headers=headers)
+
+    boundary = secrets.token_hex(16)
+    parts = [
+        f"{'' if i == 0 else CRLF}--{boundary}{CRLF}Content-Type: {media_type}{CRLF}Content-Range: bytes {start}-{end}/{size}{CRLF}{CRLF}".encode()
+        for i, (start, end) in enumerate(ranges)
+    ]
+    parts.append(f"{CRLF}--{boundary}--{CRLF}".encode())
+    headers["Content-Length"] = str(sum(map(len, parts)) + sum(end - start + 1 for start, end in ranges))
+    return StreamingResponse(
+        read_ranges(path, ranges, parts, status=206), status_code=206,
+        media_type=f"multipart/byteranges; boundary={boundary}", headers=headers
+    )
 
 class FileMetadata(BaseModel):
     id: str
     owner_id: str
     original_name: str
     content_type: str
+    size_bytes: Optional[int] = None
+    checksum: Optional[str] = None
+
+class Usage(BaseModel):
+    owner_id: str
+    file_count: int
+    used_bytes: int
+    quota_bytes: Optional[int] = None
+    available_bytes: Optional[int] = None
+
+class QuotaUpdate(BaseModel):
+    quota_bytes: Optional[int] = Field(None, ge=0)  # null falls back to STORAGE_QUOTA_BYTES, 0 = unlimited
 
 @app.get("/health")
 def health():
     return {"status": "storage is healthy"}
 
+@app.get("/db-pool")
+def db_pool_stats(_=Depends(get_admin_access)):
+    return get_pool_stats()
+
+@app.get("/metrics")
+def metrics(_=Depends(get_admin_access)):
+    return metrics_response()
+
+@app.get("/log-stats")
+def log_stats(_=Depends(get_admin_access)):
+    return get_log_stats()
+
+@app.get("/cache-stats")
+def cache_stats(_=Depends(get_admin_access)):
+    return {"jwt": token_cache.stats()}
+
+@app.get("/usage", response_model=Usage)
+@limiter.limit("60/minute")
+async def usage(request: Request, current_user: AuthInfo = Depends(get_current_user), db: AsyncConnection = Depends(get_async_read_db)):
+    return await db.run(get_usage, db.db, current_user.user_id)
+
+@app.get("/usage/{owner_id}", response_model=Usage)
+async def owner_usage(owner_id: str, _=Depends(get_admin_access), db: AsyncConnection = Depends(get_async_read_db)):
+    return await db.run(get_usage, db.db, owner_id)
+
+@app.put("/usage/{owner_id}/quota", response_model=Usage)
+async def set_quota(owner_id: str, body: QuotaUpdate, _=Depends(get_admin_access)):
+    def update_quota(db: sqlite3.Connection):
+        db.execute(
+            "INSERT INTO storage_usage (owner_id, quota_bytes) VALUES (?, ?) ON CONFLICT(owner_id) DO UPDATE SET quota_bytes = excluded.quota_bytes",
+            (owner_id, body.quota_bytes)
+        )
+        return get_usage(db, owner_id)
+
+    result = await write_async(update_quota)
+    logger.info("Quota for '%s' set to %s", owner_id, body.quota_bytes)
+    return result
+
 @app.post("/upload", response_model=FileMetadata)
 @limiter.limit("10/minute")
 async def upload_file(
     request: Request,
     file: UploadFile = File(...),
     current_user: AuthInfo = Depends(get_current_user),
-    db: sqlite3.Connection = Depends(get_db)
 ):
-    user_upload_dir = UPLOAD_DIR / current_user.user_id
-    user_upload_dir.mkdir(exist_ok=True)
-    
-    secure_disk_name = f"{secrets.token_hex(8)}_{sanitize_filename(file.filename)}"
-    file_path_on_disk = user_upload_dir / secure_disk_name
-    
+    limit = await current_upload_limit(current_user.user_id)
+    # hashed while streaming to a temp file; it becomes the blob only if the bytes are new
+    temp_path = INCOMING_DIR / secrets.token_hex(16)
+    digest, size_bytes = hashlib.sha256(), 0
     try:
-        async with aiofiles.open(file_path_on_disk, "wb") as f:
+        async with aiofiles.open(temp_path, "wb") as f:
             while content := await file.read(1024 * 1024):
+                size_bytes += len(content)
+                if size_bytes > limit:
+                    raise upload_too_large(limit)
                 await f.write(content)
+                digest.update(content)
+        STORAGE_BYTES_IN.inc(size_bytes, "multipart")
+    except HTTPException:
+        temp_path.unlink(missing_ok=True)
+        raise
     except Exception as e:
-        logger.error(f"Upload failed: {e}")
+        temp_path.unlink(missing_ok=True)
+        logger.error("Upload failed: %s", e)
         raise HTTPException(status_code=500, detail="Could not save file.")
 
+    checksum = digest.hexdigest()
     file_id = secrets.token_urlsafe(16)
-    safe_write(db,
-        "INSERT INTO files (id, owner_id, original_name, disk_path, content_type) VALUES (?, ?, ?, ?, ?)",
-        (
-            file_id,
-            current_user.user_id,
-            file.filename,
-            str(file_path_on_disk),
-            file.content_type,
-        )
-    )
-    db.commit()
+    try:
+        await write_async(store_file, file_id, current_user.user_id, file.filename, file.content_type, temp_path, checksum, size_bytes)
+    finally:
+        # still here when the blob already existed
+        temp_path.unlink(missing_ok=True)
     
-    logger.info(f"User '{current_user.user_id}' uploaded '{file.filename}' as file ID {file_id}")
+    logger.info("User '%s' uploaded '%s' as file ID %s", current_user.user_id, file.filename, file_id)
     return {
         "id": file_id,
         "owner_id": current_user.user_id,
         "original_name": file.filename,
         "content_type": file.content_type,
+        "size_bytes": size_bytes,
+        "checksum": checksum,
     }
 
+def write_all(fd: int, data):
+    while data:
+        data = data[os.write(fd, data):]
+
+def flush_buffer(fd: int, digest, data):
+    # runs in the threadpool; sha256 releases the GIL on buffers this size
+    digest.update(data)
+    write_all(fd, data)
+
+@app.post("/upload/raw", response_model=FileMetadata)
+@limiter.limit("10/minute")
+async def upload_raw(
+    request: Request,
+    filename: str = Query(..., min_length=1, max_length=255),
+    current_user: AuthInfo = Depends(get_current_user),
+):
+    # Raw request body straight to the file descriptor, no multipart spool. ASGI
+    # chunks are coalesced in one reusable buffer, and each full 1 MiB buffer is
+    # hashed and written in one threadpool call, so a slow disk never stalls the
+    # event loop and there is one thread hop per MiB rather than per chunk.
+    content_type = request.headers.get("content-type") or "application/octet-stream"
+    limit = await current_upload_limit(current_user.user_id)
+    content_length = request.headers.get("content-length", "")
+    if content_length.isdigit() and int(content_length) > limit:
+        raise upload_too_large(limit)
+
+    temp_path = INCOMING_DIR / secrets.token_hex(16)
+    digest, size_bytes = hashlib.sha256(), 0
+    buffer = memoryview(bytearray(RAW_UPLOAD_BUFFER_SIZE))
+    filled = 0
+    fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    try:
+        async for chunk in request.stream():
+            size_bytes += len(chunk)
+            if size_bytes > limit:
+                raise upload_too_large(limit)
+            chunk = memoryview(chunk)
+            while chunk:
+                n = min(len(chunk), RAW_UPLOAD_BUFFER_SIZE - filled)
+                buffer[filled:filled + n] = chunk[:n]
+                filled += n
+                chunk = chunk[n:]
+                if filled == RAW_UPLOAD_BUFFER_SIZE:
+                    await run_in_threadpool(flush_buffer, fd, digest, buffer)
+                    filled = 0
+        await run_in_threadpool(flush_buffer, fd, digest, buffer[:filled])
+        STORAGE_BYTES_IN.inc(size_bytes, "raw")
+    except ClientDisconnect:
+        temp_path.unlink(missing_ok=True)
+        raise HTTPException(status_code=400, detail="Upload interrupted")
+    except BaseException:
+        temp_path.unlink(missing_ok=True)
+        raise
+    finally:
+        os.close(fd)
+
+    checksum = digest.hexdigest()
+    file_id = secrets.token_urlsafe(16)
+    try:
+        await write_async(store_file, file_id, current_user.user_id, filename, content_type, temp_path, checksum, size_bytes)
+    finally:
+        temp_path.unlink(missing_ok=True)
+
+    logger.info("User '%s' uploaded '%s' (%s bytes, raw) as file ID %s", current_user.user_id, filename, size_bytes, file_id)
+    return {
+        "id": file_id,
+        "owner_id": current_user.user_id,
+        "original_name": filename,
+        "content_type": content_type,
+        "size_bytes": size_bytes,
+        "checksum": checksum,
+    }
+
+# --- RESUMABLE UPLOADS ---
+# tus-style: POST /uploads creates a session, PATCH /uploads/{id} appends a raw
+# chunk at Upload-Offset, POST /uploads/{id}/finalize turns it into a file.
+# Chunks are written straight into incoming/session-<id>, which finalize renames
+# into the blob store, so the bytes hit the disk once.
+
+class UploadSessionCreate(BaseModel):
+    filename: str = Field(..., min_length=1, max_length=255)
+    content_type: str = "application/octet-stream"
+    size_bytes: int = Field(..., ge=0)
+
+class UploadSession(BaseModel):
+    id: str
+    original_name: str
+    content_type: str
+    size_bytes: int
+    received_bytes: int
+
+# Running hash per session, valid only while it has seen every byte in order;
+# otherwise finalize re-reads the file (restart, or chunks served by another
+# worker). Every worker's sweep drops entries whose session row is gone.
+_upload_hashes: Dict[str, tuple] = {}
+
+def session_path(session_id: str) -> Path:
+    return INCOMING_DIR / f"session-{session_id}"
+
+def hash_file(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(1024 * 1024):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def forget_session(session_id: str):
+    _upload_hashes.pop(session_id, None)
+
+async def get_upload_session(session_id: str, current_user: AuthInfo):
+    session = await run_in_threadpool(read_one, "SELECT * FROM upload_sessions WHERE id = ?", (session_id,))
+    if not session or session["owner_id"] != current_user.user_id:
+        raise HTTPException(status_code=404, detail="Upload session not found")
+    return session
+
+def collect_abandoned_uploads():
+    expired = write(lambda db: [row["id"] for row in db.execute(
+        "DELETE FROM upload_sessions WHERE updated_at < datetime('now', ?) RETURNING id",
+        (f"-{UPLOAD_SESSION_TTL_HOURS} hours",)
+    )])
+    for session_id in expired:
+        session_path(session_id).unlink(missing_ok=True)
+        forget_session(session_id)
+    # sessions expired, finalized or aborted through another worker
+    hashed = list(_upload_hashes)
+    if hashed:
+        with pooled_connection(readonly=True) as db:
+            live = {row["id"] for row in db.execute(
+                f"SELECT id FROM upload_sessions WHERE id IN ({','.join('?' * len(hashed))})", hashed
+            )}
+        for session_id in hashed:
+            if session_id not in live:
+                forget_session(session_id)
+
+    # temp files of interrupted /upload requests and sessions whose row is gone
+    cutoff, orphans = time.time() - UPLOAD_SESSION_TTL_HOURS * 3600, 0
+    for path in INCOMING_DIR.iterdir():
+        if path.stat().st_mtime < cutoff:
+            path.unlink(missing_ok=True)
+            orphans += 1
+    if expired or orphans:
+        logger.info("Removed %s abandoned upload sessions and %s orphaned temp files.", len(expired), orphans)
+
+upload_session_gc = PeriodicJob("upload-session-gc", UPLOAD_SESSION_GC_INTERVAL, collect_abandoned_uploads, logger).start()
+
+@app.post("/uploads", response_model=UploadSession, status_code=201)
+@limiter.limit("10/minute")
+async def create_upload_session(
+    request: Request,
+    body: UploadSessionCreate,
+    current_user: AuthInfo = Depends(get_current_user),
+):
+    limit = await current_upload_limit(current_user.user_id)
+    if body.size_bytes > limit:
+        raise upload_too_large(limit)
+
+    session_id = secrets.token_urlsafe(16)
+    session_path(session_id).touch()
+    await write_async(lambda db: db.execute(
+        "INSERT INTO upload_sessions (id, owner_id, original_name, content_type, size_bytes) VALUES (?, ?, ?, ?, ?)",
+        (session_id, current_user.user_id, body.filename, body.content_type, body.size_bytes)
+    ))
+    _upload_hashes[session_id] = (hashlib.sha256(), 0)
+
+    logger.info("User '%s' started upload session %s for '%s' (%s bytes)", current_user.user_id, session_id, body.filename, body.size_bytes)
+    return FastJSONResponse(
+        {"id": session_id, "original_name": body.filename, "content_type": body.content_type, "size_bytes": body.size_bytes, "received_bytes": 0},
+        status_code=201,
+        headers={"Location": f"{request.scope.get('root_path', '')}/uploads/{session_id}", "Upload-Offset": "0"},
+    )
+
+@app.get("/uploads/{session_id}", response_model=UploadSession)
+@limiter.limit("60/minute")
+async def get_upload_status(
+    request: Request,
+    session_id: str,
+    current_user: AuthInfo = Depends(get_current_user),
+):
+    session = await get_upload_session(session_id, current_user)
+    return FastJSONResponse(
+        {key: session[key] for key in ("id", "original_name", "content_type", "size_bytes", "received_bytes")},
+        headers={"Upload-Offset": str(session["received_bytes"]), "Upload-Length": str(session["size_bytes"])},
+    )
+
+@app.patch("/uploads/{session_id}", status_code=204)
+@limiter.limit("600/minute")
+async def upload_chunk(
+    request: Request,
+    session_id: str,
+    upload_offset: int = Header(..., ge=0),
+    current_user: AuthInfo = Depends(get_current_user),
+):
+    session = await get_upload_session(session_id, current_user)
+    offset = session["received_bytes"]
+    if upload_offset != offset:
+        raise HTTPException(status_code=409, detail="Upload-Offset does not match the received bytes",
+                            headers={"Upload-Offset": str(offset)})
+
+    # Claim the offset before touching the file, so two workers can never write
+    # at it together. The claim is a lease: a PATCH stops writing before it runs
+    # out, and a crashed worker's claim simply expires.
+    token, now = secrets.token_hex(8), time.time()
+    deadline = time.monotonic() + UPLOAD_CHUNK_LEASE - 1
+    claimed = await write_async(lambda db: db.execute(
+        "UPDATE upload_sessions SET claim_token = ?, claimed_until = ? "
+        "WHERE id = ? AND received_bytes = ? AND (claimed_until IS NULL OR claimed_until < ?)",
+        (token, now + UPLOAD_CHUNK_LEASE, session_id, offset, now)
+    ).rowcount)
+    if not claimed:
+        raise HTTPException(status_code=409, detail="Another chunk is being written to this upload session")
+
+    def release_claim(db: sqlite3.Connection, received_bytes: Optional[int] = None) -> int:
+        if received_bytes is None:
+            return db.execute(
+                "UPDATE upload_sessions SET claim_token = NULL, claimed_until = NULL WHERE id = ? AND claim_token = ?",
+                (session_id, token)
+            ).rowcount
+        return db.execute(
+            "UPDATE upload_sessions SET received_bytes = ?, claim_token = NULL, claimed_until = NULL, updated_at = CURRENT_TIMESTAMP "
+            "WHERE id = ? AND claim_token = ? AND received_bytes = ?",
+            (received_bytes, session_id, token, offset)
+        ).rowcount
+
+    # Hash into a copy: the stored digest must keep covering only committed
+    # bytes, whatever happens to this chunk before its offset is recorded
+    digest, hashed = _upload_hashes.get(session_id, (None, None))
+    digest = digest.copy() if hashed == offset else None
+    remaining, received, too_large = session["size_bytes"] - offset, 0, False
+    try:
+        async with aiofiles.open(session_path(session_id), "r+b") as f:
+            await f.seek(offset)
+            try:
+                async for chunk in request.stream():
+                    if received + len(chunk) > remaining:
+                        too_large = True
+                        break
+                    if time.monotonic() > deadline:
+                        # lease nearly over: keep what arrived, the client resumes from the new offset
+                        break
+                    await f.write(chunk)
+                    received += len(chunk)
+                    if digest is not None:
+                        digest.update(chunk)
+            except ClientDisconnect:
+                # keep what arrived; the client resumes from the new offset
+                pass
+            await f.flush()
+        STORAGE_BYTES_IN.inc(received, "chunked")
+    except FileNotFoundError:
+        await write_async(release_claim)
+        raise HTTPException(status_code=404, detail="Upload session not found")
+    except BaseException:
+        await write_async(release_claim)
+        raise
+
+    if too_large:
+        # drop the partial chunk so the file matches the recorded offset again
+        async with aiofiles.open(session_path(session_id), "r+b") as f:
+            await f.truncate(offset)
+        _upload_hashes.pop(session_id, None)
+        await write_async(release_claim)
+        raise HTTPException(status_code=413, detail="Chunk goes past the declared upload length")
+
+    if not await write_async(release_claim, offset + received):
+        _upload_hashes.pop(session_id, None)
+        raise HTTPException(status_code=409, detail="Upload session changed while writing this chunk")
+    if digest is not None:
+        _upload_hashes[session_id] = (digest, offset + received)
+
+    return Response(status_code=204, headers={"Upload-Offset": str(offset + received)})
+
+@app.post("/uploads/{session_id}/finalize", response_model=FileMetadata)
+@limiter.limit("10/minute")
+async def finalize_upload(
+    request: Request,
+    session_id: str,
+    current_user: AuthInfo = Depends(get_current_user),
+):
+    session = await get_upload_session(session_id, current_user)
+    if session["received_bytes"] != session["size_bytes"]:
+        raise HTTPException(status_code=409, detail=f"Upload incomplete: {session['received_bytes']} of {session['size_bytes']} bytes received",
+                            headers={"Upload-Offset": str(session["received_bytes"])})
+
+    digest, hashed = _upload_hashes.get(session_id, (None, None))
+    temp_path = session_path(session_id)
+    if hashed == session["size_bytes"]:
+        checksum = digest.hexdigest()
+    else:
+        logger.info("Upload session %s was not hashed in this process, re-reading %s bytes", session_id, session["size_bytes"])
+        checksum = await run_in_threadpool(hash_file, temp_path)
+    file_id = secrets.token_urlsafe(16)
+
+    def store_session(db: sqlite3.Connection):
+        if not db.execute("DELETE FROM upload_sessions WHERE id = ?", (session_id,)).rowcount:
+            raise HTTPException(status_code=404, detail="Upload session not found")
+        store_file(db, file_id, current_user.user_id, session["original_name"], session["content_type"], temp_path, checksum, session["size_bytes"])
+
+    # Only once committed: after a failure (quota, rolled back batch) the session
+    # row, its file and running hash are all still there for a retry.
+    await write_async(store_session)
+    temp_path.unlink(missing_ok=True)
+    forget_session(session_id)
+
+    logger.info("User '%s' finalized upload session %s as file ID %s", current_user.user_id, session_id, file_id)
+    return {
+        "id": file_id,
+        "owner_id": current_user.user_id,
+        "original_name": session["original_name"],
+        "content_type": session["content_type"],
+        "size_bytes": session["size_bytes"],
+        "checksum": checksum,
+    }
+
+@app.delete("/uploads/{session_id}", status_code=204)
+@limiter.limit("10/minute")
+async def abort_upload(
+    request: Request,
+    session_id: str,
+    current_user: AuthInfo = Depends(get_current_user),
+):
+    await get_upload_session(session_id, current_user)
+    await write_async(lambda db: db.execute("DELETE FROM upload_sessions WHERE id = ?", (session_id,)))
+    session_path(session_id).unlink(missing_ok=True)
+    forget_session(session_id)
+    return Response(status_code=204)
+
 @app.get("/download/{file_id}")
 @limiter.limit("60/minute")
-async def download_file(request: Request, file_id: str, db: sqlite3.Connection = Depends(get_db)):
-    result = db.execute(
-        "SELECT disk_path FROM files WHERE id = ?", (file_id,)
-    ).fetchone()
+async def download_file(request: Request, file_id: str, db: AsyncConnection = Depends(get_async_read_db)):
+    result = await db.fetchone(
+        "SELECT disk_path, original_name, checksum, created_at FROM files WHERE id = ?", (file_id,)
+    )
     
     if not result:
         raise HTTPException(status_code=404, detail="File not found in DB")
     
-    file_path = Path(result[0])
-    if not file_path.is_file():
-        logger.error(f"File ID {file_id} found in DB but missing on disk at {file_path}")
+    file_path = Path(result["disk_path"])
+    media_type = mimetypes.guess_type(result["original_name"])[0] or "application/octet-stream"
+    try:
+        relative_path = file_path.resolve().relative_to(UPLOAD_DIR.resolve()).as_posix() if DOWNLOAD_ACCEL_PREFIX else None
+    except ValueError:
+        # legacy rows stored outside files/ are not reachable through the nginx location
+        relative_path = None
+    if relative_path is not None:
+        headers = {
+            "X-Accel-Redirect": DOWNLOAD_ACCEL_PREFIX.rstrip("/") + "/" + quote(relative_path),
+            "Cache-Control": DOWNLOAD_CACHE_CONTROL,
+        }
+        STORAGE_DOWNLOADS.inc(1, "accel")
+        return Response(media_type=media_type, headers=headers)
+
+    try:
+        stat_result = file_path.stat()
+    except FileNotFoundError:
+        stat_result = None
+    if stat_result is None or not stat.S_ISREG(stat_result.st_mode):
+        logger.error("File ID %s found in DB but missing on disk at %s", file_id, file_path)
         raise HTTPException(status_code=404, detail="File not found on disk")
-        
-    return FileResponse(file_path)
+
+    # Files never change once uploaded, so the upload checksum is a strong validator
+    etag = f'"{result["checksum"]}"' if result["checksum"] else make_etag(file_id, stat_result.st_size, stat_result.st_mtime)
+    last_modified = parse_db_timestamp(result["created_at"])
+    if is_not_modified(request, etag, last_modified):
+        response = not_modified(etag, last_modified)
+        response.headers["Cache-Control"] = DOWNLOAD_CACHE_CONTROL
+        return response
+
+    headers = {"ETag": etag, "Last-Modified": http_date(last_modified), "Cache-Control": DOWNLOAD_CACHE_CONTROL}
+    ranges = None
+    http_range = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    # If-Range: only honour Range when the client's copy is still current
+    if http_range and (if_range is None or if_range.strip() in (etag, headers["Last-Modified"])):
+        ranges = parse_range_header(http_range, stat_result.st_size)
+    STORAGE_DOWNLOADS.inc(1, "direct")
+    return range_response(file_path, stat_result.st_size, media_type, headers, ranges)
 
 @app.get("/list", response_model=List[FileMetadata])
 @limiter.limit("30/minute")
-async def list_user_files(request: Request, current_user: AuthInfo = Depends(get_current_user), db: sqlite3.Connection = Depends(get_db)):
-    db.row_factory = sqlite3.Row
-    rows = db.execute(
+async def list_user_files(request: Request, current_user: AuthInfo = Depends(get_current_user), db: AsyncConnection = Depends(get_async_read_db)):
+    rows = await db.fetchall(
         """
-        SELECT id, owner_id, original_name, content_type
+        SELECT id, owner_id, original_name, content_type, size_bytes, checksum
         FROM files
         WHERE owner_id = ?
         ORDER BY created_at DESC
         """,
         (current_user.user_id,)
-    ).fetchall()
+    )
     return [dict(row) for row in rows]
 
 @app.delete("/delete/{file_id}", status_code=200)
@@ -142,32 +893,28 @@ async def delete_file(
     request: Request,
     file_id: str,
     current_user: AuthInfo = Depends(get_current_user),
-    db: sqlite3.Connection = Depends(get_db)
 ):
-    
-    db.row_factory = sqlite3.Row
-    file_record = db.execute(
-        "SELECT * FROM files WHERE id = ?", (file_id,)
-    ).fetchone()
+    def delete_record(db: sqlite3.Connection):
+        file_record = db.execute(
+            "SELECT * FROM files WHERE id = ?", (file_id,)
+        ).fetchone()
 
-    if not file_record:
-        raise HTTPException(status_code=404, detail="File not found")
+        if not file_record:
+            raise HTTPException(status_code=404, detail="File not found")
 
-    if file_record["owner_id"] != current_user.user_id:
-        raise HTTPException(status_code=403, detail="Not authorized to delete this file")
+        if file_record["owner_id"] != current_user.user_id:
+            raise HTTPException(status_code=403, detail="Not authorized to delete this file")
 
-    # remove from disk
-    file_path = Path(file_record["disk_path"])
-    if file_path.exists():
-        file_path.unlink()
-        logger.info(f"File physically removed: {file_path}")
-    else:
-        logger.warning(f"File metadata found but missing on disk: {file_path}")
+        db.execute("DELETE FROM files WHERE id = ?", (file_id,))
+        return file_record, remove_blob_reference(db, file_record)
 
-    # remove from DB
-    safe_write(db, "DELETE FROM files WHERE id = ?", (file_id,))
-    db.commit()
-    logger.info(f"User '{current_user.user_id}' deleted file ID {file_id}")
+    file_record, unused_path = await write_async(delete_record)
+    if unused_path is not None:
+        try:
+            await write_async(unlink_unreferenced_blob, unused_path)
+        except Exception as e:
+            logger.error("Could not remove %s after deleting file ID %s, left as orphan: %s", unused_path, file_id, e)
+    logger.info("User '%s' deleted file ID %s", current_user.user_id, file_id)
 
     return {
         "message": f"{file_record['original_name']} deleted successfully"
@@ -175,12 +922,28 @@ async def delete_file(
 
 @app.get("/listall", response_model=List[FileMetadata])
 @limiter.limit("10/minute")
-async def list_all_files(request: Request, _=Depends(get_admin_access), db: sqlite3.Connection = Depends(get_db)):
-    db.row_factory = sqlite3.Row
-    rows = db.execute("""
-        SELECT id, owner_id, original_name, content_type
+async def list_all_files(
+    request: Request,
+    _=Depends(get_admin_access),
+    db: AsyncConnection = Depends(get_async_read_db),
+    stream: Optional[str] = Query(None, pattern="^(ndjson|json)$", description="Stream rows instead of building the whole list"),
+):
+    sql = """
+        SELECT id, owner_id, original_name, content_type, size_bytes, checksum
         FROM files
         ORDER BY created_at DESC
-    """).fetchall()
+    """
+    if stream:
+        return stream_query(sql, fmt=stream)
+    rows = await db.fetchall(sql)
     return [dict(row) for row in rows]
 
+if __name__ == "__main__":
+    # Maintenance commands, run from the storage directory: python main.py backfill-usage
+    if sys.argv[1:] == ["backfill-usage"]:
+        with sqlite3.connect(DB_PATH) as db:
+            sized, missing = backfill_usage(db)
+        logger.info("Usage backfill: sized %s files, %s missing on disk.", sized, missing)
+    else:
+        print("Usage: python main.py backfill-usage")
+        sys.exit(1)
@@ -0,0 +1,69 @@
+import hashlib
+import importlib
+import os
+import shutil
+import sys
+from pathlib import Path
+
+import pytest
+from fastapi.testclient import TestClient
+
+SERVICE_DIR = Path(__file__).resolve().parent.parent
+
+
+@pytest.fixture
+def storage(tmp_path, monkeypatch):
+    # A fresh copy of the service per test: main.py creates storage.db and files/ in its cwd
+    workdir = tmp_path / "storage"
+    workdir.mkdir()
+    (tmp_path / "logs" / "storage").mkdir(parents=True)
+    for name in ("main.py", "helpers.py"):
+        shutil.copy(SERVICE_DIR / name, workdir / name)
+    monkeypatch.chdir(workdir)
+    monkeypatch.setenv("DB_PATH", "storage.db")
+    monkeypatch.setenv("JWT_SECRET", "test-secret")
+    monkeypatch.setenv("RATE_LIMIT_STORAGE_URI", "memory://")
+    monkeypatch.syspath_prepend(str(workdir))
+    for module in ("main", "helpers"):
+        sys.modules.pop(module, None)
+    main = importlib.import_module("main")
+    helpers = importlib.import_module("helpers")
+    client = TestClient(main.app, raise_server_exceptions=False)
+    token = helpers.create_jwt({"sub": "user-1", "email": "user-1@example.com"})
+    yield main, client, {"Authorization": f"Bearer {token}"}
+    for module in ("main", "helpers"):
+        sys.modules.pop(module, None)
+
+
+def test_failed_chunk_does_not_leak_into_checksum(storage, monkeypatch):
+    main, client, auth = storage
+    data = os.urandom(3000)
+    session_id = client.post("/uploads", json={"filename": "a.bin", "size_bytes": len(data)}, headers=auth).json()["id"]
+    assert client.patch(f"/uploads/{session_id}", content=data[:1000], headers={**auth, "Upload-Offset": "0"}).status_code == 204
+
+    # fails after the chunk was written and hashed, before its offset is committed
+    def fail(*args):
+        raise RuntimeError("simulated failure")
+    with monkeypatch.context() as m:
+        m.setattr(main.STORAGE_BYTES_IN, "inc", fail)
+        response = client.patch(f"/uploads/{session_id}", content=b"x" * 1000, headers={**auth, "Upload-Offset": "1000"})
+    assert response.status_code == 500
+
+    assert client.patch(f"/uploads/{session_id}", content=data[1000:], headers={**auth, "Upload-Offset": "1000"}).status_code == 204
+    response = client.post(f"/uploads/{session_id}/finalize", headers=auth)
+    assert response.status_code == 200
+    checksum = hashlib.sha256(data).hexdigest()
+    assert response.json()["checksum"] == checksum
+    download = client.get(f"/download/{response.json()['id']}")
+    assert download.content == data
+    assert checksum in download.headers["etag"]
+
+
+def test_sweep_forgets_hashes_of_sessions_gone_elsewhere(storage):
+    main, client, auth = storage
+    session_id = client.post("/uploads", json={"filename": "a.bin", "size_bytes": 10}, headers=auth).json()["id"]
+    assert session_id in main._upload_hashes
+    # finalized or aborted through another worker: only the row is gone
+    main.write(lambda db: db.execute("DELETE FROM upload_sessions WHERE id = ?", (session_id,)))
+    main.collect_abandoned_uploads()
+    assert session_id not in main._upload_hashes